@@ -1,13 +1,22 @@
-import json
+import hashlib
+import itertools
 import logging
 import os
 import re
 import secrets
+import string
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set, Tuple
+from . import json_utils
 from .time_utils import now_beijing
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 try:
@@ -24,6 +33,13 @@ try:
 except ImportError:  # pragma: no cover - optional dependency
     HAS_DASHSCOPE = False
 
+try:
+    import re2
+
+    HAS_RE2 = True
+except ImportError:  # pragma: no cover - optional dependency
+    HAS_RE2 = False
+
 
 logging.basicConfig(level=logging.INFO)
 
@@ -36,9 +52,28 @@ LLM_CHAT_MODEL = os.getenv("LLM_CHAT_MODEL", "")
 LLM_EMBED_MODEL = os.getenv("LLM_EMBED_MODEL", "")
 AI_ENABLED = os.getenv("AI_ENABLED", "false").strip().lower() in ("1", "true", "yes", "on")
 SHORT_TITLE_MAX_LEN = int(os.getenv("SHORT_TITLE_MAX_LEN", "32"))
+# Off by default: entries hold the extracted secrets in plaintext, shared by
+# every user of the process and kept after the note changes.
+ANONYMIZE_CACHE_SIZE = int(os.getenv("ANONYMIZE_CACHE_SIZE", "0"))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+EMBED_BATCH_SIZE = max(1, int(os.getenv("EMBED_BATCH_SIZE", "10")))
+# LLM requests in flight at once for bulk analysis, across all requests.
+AI_CONCURRENCY = max(1, int(os.getenv("AI_CONCURRENCY", "4")))
+
+
+def _compile_linear(source: str):
+    # RE2 matches in linear time instead of backtracking, which keeps the
+    # unbounded {n,} candidate scans safe on arbitrary note content. Only use it
+    # for explicit ASCII classes: RE2 has no lookaround and its shorthand
+    # classes are ASCII-only, unlike the stdlib's Unicode defaults.
+    if HAS_RE2:
+        return re2.compile(source)
+    return re.compile(source)
 
 
 ANON_PLACEHOLDER_PATTERN = re.compile(r"\bANON_[0-9a-f]{8}\b")
+# Unanchored: placeholders can directly follow a CJK character, where \b fails.
+ANON_PLACEHOLDER_SCAN_PATTERN = re.compile(r"ANON_[0-9a-f]{8}")
 
 EMAIL_PATTERN = re.compile(r"[\w.\-]+@[\w.\-]+\.\w+")
 PHONE_PATTERN = re.compile(
@@ -61,13 +96,23 @@ LABELLED_SECRET_PATTERN = re.compile(
 INLINE_SECRET_PATTERN = re.compile(r"(password|token|key|secret|pwd)\s+\S+", re.I)
 IP_PATTERN = re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}\b")
 
-HEX_TOKEN_PATTERN = re.compile(r"[a-fA-F0-9]{32,}")
-BASE64_TOKEN_PATTERN = re.compile(r"[A-Za-z0-9+/]{24,}={0,2}")
-TOKEN_CANDIDATE_PATTERN = re.compile(r"[A-Za-z0-9_+/=\-]{16,}")
-PASSWORD_CANDIDATE_PATTERN = re.compile(
+HEX_TOKEN_PATTERN = _compile_linear(r"[a-fA-F0-9]{32,}")
+BASE64_TOKEN_PATTERN = _compile_linear(r"[A-Za-z0-9+/]{24,}={0,2}")
+TOKEN_CANDIDATE_PATTERN = _compile_linear(r"[A-Za-z0-9_+/=\-]{16,}")
+PASSWORD_CANDIDATE_PATTERN = _compile_linear(
     r"[A-Za-z0-9!@#$%^&*()_+=\-\[\]{}|:;,.?/~`]{8,}"
 )
 
+ASCII_LETTER_PATTERN = re.compile(r"[A-Za-z]")
+DIGIT_PATTERN = re.compile(r"\d")
+TOKEN_SYMBOL_PATTERN = re.compile(r"[+/=_-]")
+
+CREDENTIAL_HINT_PATTERN = re.compile(r"(token|password|passwd|pwd|secret|ssh|ip|credential)")
+TODO_HINT_PATTERN = re.compile(r"(todo|to-do|task|next|remind|follow up|deadline)")
+WORK_HINT_PATTERN = re.compile(r"(project|meeting|review|weekly|progress|work)")
+TAG_WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9_-]{2,}")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
 SENSITIVE_PATTERNS = [
     LABELLED_SECRET_PATTERN,
     INLINE_SECRET_PATTERN,
@@ -83,8 +128,57 @@ SENSITIVE_PATTERNS = [
     STRIPE_KEY_PATTERN,
 ]
 
+
+def _fuse_patterns(patterns: List[re.Pattern]) -> re.Pattern:
+    # One alternation finds a match wherever any of the patterns would, in a
+    # single scan. Only good for detection: substituting with it would let a
+    # leftmost match (say a URL ending in "token") swallow what a later
+    # pattern needed, so the ordered per-pattern subs must not be replaced.
+    parts: List[str] = []
+    for pattern in patterns:
+        source = pattern.pattern
+        if pattern.flags & re.IGNORECASE:
+            source = f"(?i:{source})"
+        parts.append(f"(?:{source})")
+    return re.compile("|".join(parts))
+
+
+FUSED_SENSITIVE_PATTERN = _fuse_patterns(SENSITIVE_PATTERNS)
+
+# Every sensitive pattern and both candidate checks need at least one of: a digit,
+# a symbol from the complex-password set, a 16-char token run, "xox", or a secret
+# keyword. Text without any of them (e.g. plain CJK prose) skips the full scans.
+PRESCREEN_CHAR_PATTERN = re.compile(r"[\d!@#$%^&*()+=\[\]{}|:;,.?/~`]")
+PRESCREEN_TOKEN_RUN_PATTERN = re.compile(r"[A-Za-z0-9_+/=\-]{16}")
+PRESCREEN_KEYWORDS = ("password", "passwd", "pwd", "token", "key", "secret", "credential", "xox")
+# re's IGNORECASE also matches these against i/s, but str.lower() leaves them alone.
+_PRESCREEN_FOLD = {0x130: "i", 0x131: "i", 0x17F: "s"}
+
 DEFAULT_CATEGORIES = ["credential", "work", "idea", "todo"]
 
+_ASCII_LOWER = frozenset(string.ascii_lowercase)
+_ASCII_UPPER = frozenset(string.ascii_uppercase)
+_ASCII_DIGITS = frozenset(string.digits)
+_ASCII_ALNUM = _ASCII_LOWER | _ASCII_UPPER | _ASCII_DIGITS
+_STRONG_SYMBOLS = frozenset("!@#$%^&*()+=[]{}|:;,.?/~`")
+
+# Placeholders come from one process-wide counter (randomly seeded once) rather
+# than per-call randomness; unlike a per-mapping counter, mappings of different
+# texts can still be merged without clashes.
+_placeholder_counter = itertools.count(secrets.randbits(32))
+
+# blake2b(text) -> (anonymized, mapping items); most recently used last.
+_anonymize_cache: "OrderedDict[bytes, Tuple[str, Tuple[Tuple[str, str], ...]]]" = OrderedDict()
+_anonymize_cache_lock = threading.Lock()
+
+# Search queries repeat while paging through results, so the LLM parse and
+# the query embedding are memoized. Most recently used last.
+# (query, today's date) -> parsed search intent
+_search_parse_cache: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+# query text -> embedding
+_query_embedding_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+
 
 def _is_placeholder(value: str) -> bool:
     return bool(ANON_PLACEHOLDER_PATTERN.fullmatch(value))
@@ -92,35 +186,38 @@ def _is_placeholder(value: str) -> bool:
 
 def _new_placeholder(mapping: Dict[str, str], original: str) -> str:
     while True:
-        placeholder = f"ANON_{secrets.token_hex(4)}"
+        placeholder = f"ANON_{next(_placeholder_counter) & 0xFFFFFFFF:08x}"
         if placeholder not in mapping:
             mapping[placeholder] = original
             return placeholder
 
 
-def _count_char_groups(value: str) -> int:
+def _char_groups(chars: Set[str]) -> int:
+    # Set membership checks over the distinct characters replace one regex
+    # search per group. Digits keep re's \d meaning (any Unicode decimal).
+    others = chars - _ASCII_ALNUM
     groups = 0
-    if re.search(r"[a-z]", value):
+    if not chars.isdisjoint(_ASCII_LOWER):
         groups += 1
-    if re.search(r"[A-Z]", value):
+    if not chars.isdisjoint(_ASCII_UPPER):
         groups += 1
-    if re.search(r"\d", value):
+    if not chars.isdisjoint(_ASCII_DIGITS) or any(char.isdecimal() for char in others):
         groups += 1
-    if re.search(r"[^A-Za-z0-9]", value):
+    if others:
         groups += 1
     return groups
 
 
+def _count_char_groups(value: str) -> int:
+    return _char_groups(set(value))
+
+
 def _looks_like_complex_password(value: str) -> bool:
     if len(value) < 8 or _is_placeholder(value):
         return False
-    groups = _count_char_groups(value)
-    has_strong_symbol = bool(re.search(r"[!@#$%^&*()+=\[\]{}|:;,.?/~`]", value))
-    if groups >= 4 and has_strong_symbol:
-        return True
-    if groups >= 3 and has_strong_symbol:
-        return True
-    return False
+    chars = set(value)
+    # The strong-symbol check is the cheaper one and rejects most words first.
+    return not chars.isdisjoint(_STRONG_SYMBOLS) and _char_groups(chars) >= 3
 
 
 def _looks_like_token(value: str) -> bool:
@@ -130,13 +227,9 @@ def _looks_like_token(value: str) -> bool:
         return True
     if BASE64_TOKEN_PATTERN.fullmatch(value):
         return True
-    if len(value) < 20:
+    if len(value) < 20 or not ASCII_LETTER_PATTERN.search(value):
         return False
-    if re.search(r"[A-Za-z]", value) and re.search(r"\d", value):
-        return True
-    if re.search(r"[A-Za-z]", value) and re.search(r"[+/=_-]", value):
-        return True
-    return False
+    return bool(DIGIT_PATTERN.search(value) or TOKEN_SYMBOL_PATTERN.search(value))
 
 
 def _replace_candidates(
@@ -145,19 +238,13 @@ def _replace_candidates(
     predicate,
     mapping: Dict[str, str],
 ) -> str:
-    parts: List[str] = []
-    last_index = 0
-    for match in pattern.finditer(text):
+    def replace_match(match: re.Match) -> str:
         candidate = match.group(0)
         if not predicate(candidate):
-            continue
-        parts.append(text[last_index : match.start()])
-        parts.append(_new_placeholder(mapping, candidate))
-        last_index = match.end()
-    if not parts:
-        return text
-    parts.append(text[last_index:])
-    return "".join(parts)
+            return candidate
+        return _new_placeholder(mapping, candidate)
+
+    return pattern.sub(replace_match, text)
 
 
 def _contains_candidate(text: str, pattern: re.Pattern, predicate) -> bool:
@@ -167,20 +254,45 @@ def _contains_candidate(text: str, pattern: re.Pattern, predicate) -> bool:
     return False
 
 
-def _restore_mapping_in_obj(data: Any, mapping: Dict[str, str]) -> Any:
+def restore_sensitive_data_in_obj(data: Any, mapping: Dict[str, str]) -> Any:
+    """Restore placeholders in every string of a JSON-like structure (dict keys are kept)."""
     if not mapping:
         return data
     if isinstance(data, str):
         return restore_sensitive_data(data, mapping)
     if isinstance(data, list):
-        return [_restore_mapping_in_obj(item, mapping) for item in data]
+        return [restore_sensitive_data_in_obj(item, mapping) for item in data]
     if isinstance(data, dict):
-        return {key: _restore_mapping_in_obj(value, mapping) for key, value in data.items()}
+        return {key: restore_sensitive_data_in_obj(value, mapping) for key, value in data.items()}
     return data
 
 
 def anonymize_sensitive_data(text: str) -> Tuple[str, Dict[str, str]]:
+    # Summaries and questions re-send overlapping notes, so the regex scans can
+    # be memoized per content hash (ANONYMIZE_CACHE_SIZE > 0). Callers get a
+    # fresh mapping dict on every call.
+    if ANONYMIZE_CACHE_SIZE <= 0:
+        return _anonymize_uncached(text)
+    digest = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    with _anonymize_cache_lock:
+        cached = _anonymize_cache.get(digest)
+        if cached is not None:
+            _anonymize_cache.move_to_end(digest)
+    if cached is not None:
+        anonymized, items = cached
+        return anonymized, dict(items)
+    anonymized, mapping = _anonymize_uncached(text)
+    with _anonymize_cache_lock:
+        _anonymize_cache[digest] = (anonymized, tuple(mapping.items()))
+        while len(_anonymize_cache) > ANONYMIZE_CACHE_SIZE:
+            _anonymize_cache.popitem(last=False)
+    return anonymized, mapping
+
+
+def _anonymize_uncached(text: str) -> Tuple[str, Dict[str, str]]:
     mapping: Dict[str, str] = {}
+    if not _may_contain_sensitive(text):
+        return text, mapping
 
     def replace_match(match: re.Match) -> str:
         original = match.group(0)
@@ -189,8 +301,13 @@ def anonymize_sensitive_data(text: str) -> Tuple[str, Dict[str, str]]:
         return _new_placeholder(mapping, original)
 
     anonymized = text
-    for pattern in SENSITIVE_PATTERNS:
-        anonymized = pattern.sub(replace_match, anonymized)
+    # Each pattern runs on the previous one's output, in list order: the
+    # labelled/inline secret passes must mask a keyword's value before a URL
+    # or email match can consume the keyword. The fused search only skips the
+    # passes when none of them could match.
+    if FUSED_SENSITIVE_PATTERN.search(text):
+        for pattern in SENSITIVE_PATTERNS:
+            anonymized = pattern.sub(replace_match, anonymized)
     anonymized = _replace_candidates(
         anonymized, PASSWORD_CANDIDATE_PATTERN, _looks_like_complex_password, mapping
     )
@@ -200,16 +317,40 @@ def anonymize_sensitive_data(text: str) -> Tuple[str, Dict[str, str]]:
 
 
 def restore_sensitive_data(text: str, mapping: Dict[str, str]) -> str:
-    restored = text
-    for placeholder, original in mapping.items():
-        restored = restored.replace(placeholder, original)
-    return restored
+    # Most strings in an LLM response carry no placeholder; a substring check
+    # is cheaper than starting a regex scan.
+    if not mapping or "ANON_" not in text:
+        return text
+
+    def replace_placeholder(match: re.Match) -> str:
+        placeholder = match.group(0)
+        original = mapping.get(placeholder)
+        if original is None:
+            return placeholder
+        # The candidate passes can wrap an earlier placeholder, so expand nested ones.
+        if "ANON_" in original:
+            return ANON_PLACEHOLDER_SCAN_PATTERN.sub(replace_placeholder, original)
+        return original
+
+    return ANON_PLACEHOLDER_SCAN_PATTERN.sub(replace_placeholder, text)
+
+
+def _may_contain_sensitive(text: str) -> bool:
+    # A character class, a fixed-length run and plain substring checks are far
+    # cheaper than one case-insensitive alternation over the whole text.
+    if PRESCREEN_CHAR_PATTERN.search(text) or PRESCREEN_TOKEN_RUN_PATTERN.search(text):
+        return True
+    if not text.isascii() and any(chr(code) in text for code in _PRESCREEN_FOLD):
+        text = text.translate(_PRESCREEN_FOLD)
+    lowered = text.lower()
+    return any(keyword in lowered for keyword in PRESCREEN_KEYWORDS)
 
 
 def detect_sensitive(text: str) -> bool:
-    for pattern in SENSITIVE_PATTERNS:
-        if pattern.search(text):
-            return True
+    if not _may_contain_sensitive(text):
+        return False
+    if FUSED_SENSITIVE_PATTERN.search(text):
+        return True
     if _contains_candidate(text, PASSWORD_CANDIDATE_PATTERN, _looks_like_complex_password):
         return True
     if _contains_candidate(text, TOKEN_CANDIDATE_PATTERN, _looks_like_token):
@@ -217,20 +358,24 @@ def detect_sensitive(text: str) -> bool:
     return False
 
 
+def _unique_matches(pattern: re.Pattern, text: str) -> List[str]:
+    return list(dict.fromkeys(match.group(0) for match in pattern.finditer(text)))
+
+
 def extract_entities(text: str) -> Dict[str, Any]:
     entities: Dict[str, Any] = {}
-    ips = re.findall(r"\b\d{1,3}(?:\.\d{1,3}){3}\b", text)
+    ips = _unique_matches(IP_PATTERN, text)
     if ips:
-        entities["ips"] = list(dict.fromkeys(ips))
-    emails = EMAIL_PATTERN.findall(text)
+        entities["ips"] = ips
+    emails = _unique_matches(EMAIL_PATTERN, text)
     if emails:
-        entities["emails"] = list(dict.fromkeys(emails))
-    phones = PHONE_PATTERN.findall(text)
+        entities["emails"] = emails
+    phones = _unique_matches(PHONE_PATTERN, text)
     if phones:
-        entities["phones"] = list(dict.fromkeys(phones))
-    urls = URL_PATTERN.findall(text)
+        entities["phones"] = phones
+    urls = _unique_matches(URL_PATTERN, text)
     if urls:
-        entities["urls"] = list(dict.fromkeys(urls))
+        entities["urls"] = urls
     return entities
 
 
@@ -250,11 +395,11 @@ def _normalize_category_options(categories: Optional[List[str]]) -> List[str]:
 
 def _heuristic_category(text: str, categories: Optional[List[str]] = None) -> str:
     lowered = text.lower()
-    if re.search(r"(token|password|passwd|pwd|secret|ssh|ip|credential)", lowered):
+    if CREDENTIAL_HINT_PATTERN.search(lowered):
         default = "credential"
-    elif re.search(r"(todo|to-do|task|next|remind|follow up|deadline)", lowered):
+    elif TODO_HINT_PATTERN.search(lowered):
         default = "todo"
-    elif re.search(r"(project|meeting|review|weekly|progress|work)", lowered):
+    elif WORK_HINT_PATTERN.search(lowered):
         default = "work"
     else:
         default = "idea"
@@ -271,29 +416,30 @@ def _heuristic_category(text: str, categories: Optional[List[str]] = None) -> st
 
 def _heuristic_tags(text: str, category: str) -> List[str]:
     tags = {category}
-    if "github" in text.lower():
+    lowered = text.lower()
+    if "github" in lowered:
         tags.add("github")
-    if "paper" in text.lower():
+    if "paper" in lowered:
         tags.add("paper")
-    if "server" in text.lower():
+    if "server" in lowered:
         tags.add("server")
-    if "token" in text.lower() or "password" in text.lower():
+    if "token" in lowered or "password" in lowered:
         tags.add("secret")
-    words = re.findall(r"[A-Za-z][A-Za-z0-9_-]{2,}", text)
+    words = TAG_WORD_PATTERN.findall(text)
     for word in words[:6]:
         tags.add(word.lower())
     return sorted(tags)[:6]
 
 
 def _heuristic_summary(text: str) -> str:
-    cleaned = re.sub(r"\s+", " ", text).strip()
+    cleaned = WHITESPACE_PATTERN.sub(" ", text).strip()
     if len(cleaned) <= 120:
         return cleaned
     return cleaned[:117] + "..."
 
 
 def _heuristic_title(text: str) -> str:
-    cleaned = re.sub(r"\s+", " ", text).strip()
+    cleaned = WHITESPACE_PATTERN.sub(" ", text).strip()
     if not cleaned:
         return ""
     if len(cleaned) <= 60:
@@ -302,7 +448,7 @@ def _heuristic_title(text: str) -> str:
 
 
 def _normalize_short_title(text: str) -> str:
-    cleaned = re.sub(r"\s+", " ", text).strip()
+    cleaned = WHITESPACE_PATTERN.sub(" ", text).strip()
     if not cleaned:
         return ""
     if len(cleaned) <= SHORT_TITLE_MAX_LEN:
@@ -328,8 +474,8 @@ def _parse_qwen_json(raw: str) -> Optional[Dict[str, Any]]:
         return None
     snippet = raw[start : end + 1]
     try:
-        return json.loads(snippet)
-    except json.JSONDecodeError:
+        return json_utils.loads(snippet)
+    except json_utils.JSONDecodeError:
         return None
 
 
@@ -337,10 +483,14 @@ def _llm_allowed(use_ai: bool) -> bool:
     return AI_ENABLED and use_ai
 
 
+# Provider settings are read once at import, so these checks are memoized and
+# dashscope.api_key is assigned once instead of on every LLM call.
+@lru_cache(maxsize=None)
 def _provider_enabled(provider: str) -> bool:
     return LLM_PROVIDER == provider and bool(LLM_API_KEY)
 
 
+@lru_cache(maxsize=1)
 def _dashscope_ready() -> bool:
     if not (HAS_DASHSCOPE and _provider_enabled("dashscope")):
         return False
@@ -348,6 +498,23 @@ def _dashscope_ready() -> bool:
     return True
 
 
+def _build_http_session() -> requests.Session:
+    # Keep-alive pool so repeated LLM/embedding calls skip the TCP+TLS handshake.
+    # Retry only covers connection failures; POSTs are not replayed after a read.
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(total=2, backoff_factor=0.2),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_http_session = _build_http_session()
+
+
 def _openai_request(endpoint: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     if not (_provider_enabled("openai") or _provider_enabled("openai_compatible")):
         return None
@@ -359,7 +526,7 @@ def _openai_request(endpoint: str, payload: Dict[str, Any]) -> Optional[Dict[str
     }
     url = f"{LLM_API_BASE_URL}{endpoint}"
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=20)
+        response = _http_session.post(url, headers=headers, json=payload, timeout=20)
     except requests.RequestException:
         return None
     if response.status_code >= 400:
@@ -404,23 +571,36 @@ def _normalize_search_parse(parsed: Optional[Dict[str, Any]], query: str) -> Dic
             time_start = str(raw_start).strip() or None
         if raw_end:
             time_end = str(raw_end).strip() or None
-    keywords = [query] + keywords
-    deduped: List[str] = []
-    seen = set()
-    for item in keywords:
-        lowered = item.lower()
-        if lowered in seen:
-            continue
-        seen.add(lowered)
-        deduped.append(item)
+    # Dicts keep insertion order, so the first spelling of each keyword wins.
+    first_by_key: Dict[str, str] = {}
+    for item in [query] + keywords:
+        first_by_key.setdefault(item.lower(), item)
     return {
         "semantic_query": semantic_query,
-        "keywords": deduped,
+        "keywords": list(first_by_key.values()),
         "time_start": time_start,
         "time_end": time_end,
     }
 
 
+def _query_cache_get(cache: "OrderedDict[Any, Any]", key: Any) -> Any:
+    with _query_cache_lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+
+def _query_cache_put(cache: "OrderedDict[Any, Any]", key: Any, value: Any) -> None:
+    if QUERY_CACHE_SIZE <= 0:
+        return
+    with _query_cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > QUERY_CACHE_SIZE:
+            cache.popitem(last=False)
+
+
 def parse_search_query(
     query: str,
     now: Optional[datetime] = None,
@@ -430,7 +610,12 @@ def parse_search_query(
     anonymized_query, mapping = anonymize_sensitive_data(query)
     if not _llm_allowed(use_ai):
         normalized = _normalize_search_parse(None, anonymized_query)
-        return _restore_mapping_in_obj(normalized, mapping)
+        return restore_sensitive_data_in_obj(normalized, mapping)
+    # Relative time phrases resolve against today, so the date is part of the key.
+    cache_key = (query, now.strftime("%Y-%m-%d"))
+    cached = _query_cache_get(_search_parse_cache, cache_key)
+    if cached is not None:
+        return {**cached, "keywords": list(cached["keywords"])}
     prompt = (
         "You extract search intent and time range for a personal notes app. "
         "Return ONLY valid JSON with keys: semantic_query, keywords, time_start, time_end. "
@@ -453,20 +638,60 @@ def parse_search_query(
     if not response:
         response = _openai_chat(prompt)
     parsed = _parse_qwen_json(response) if response else None
-    normalized = _normalize_search_parse(parsed, anonymized_query)
-    return _restore_mapping_in_obj(normalized, mapping)
+    normalized = restore_sensitive_data_in_obj(
+        _normalize_search_parse(parsed, anonymized_query), mapping
+    )
+    if parsed is not None:
+        # Failed calls are not cached, so the next request retries the LLM.
+        _query_cache_put(
+            _search_parse_cache,
+            cache_key,
+            {**normalized, "keywords": list(normalized["keywords"])},
+        )
+    return normalized
 
 
-def _openai_embedding(text: str) -> Optional[List[float]]:
+def _openai_embeddings(texts: List[str]) -> List[Optional[List[float]]]:
     model = LLM_EMBED_MODEL or "text-embedding-3-small"
-    payload = {"model": model, "input": text}
+    payload = {"model": model, "input": texts if len(texts) > 1 else texts[0]}
+    results: List[Optional[List[float]]] = [None] * len(texts)
     data = _openai_request("/v1/embeddings", payload)
     if not data:
-        return None
+        return results
     try:
-        return data["data"][0]["embedding"]
-    except (KeyError, IndexError, TypeError):
-        return None
+        for position, item in enumerate(data["data"]):
+            index = item.get("index", position)
+            if isinstance(index, int) and 0 <= index < len(texts):
+                results[index] = item["embedding"]
+    except (KeyError, TypeError, AttributeError):
+        return [None] * len(texts)
+    return results
+
+
+def _dashscope_embeddings(texts: List[str]) -> List[Optional[List[float]]]:
+    results: List[Optional[List[float]]] = [None] * len(texts)
+    response = dashscope.TextEmbedding.call(
+        model=LLM_EMBED_MODEL or dashscope.TextEmbedding.Models.text_embedding_v1,
+        input=texts if len(texts) > 1 else texts[0],
+    )
+    if response.status_code != 200:
+        return results
+    output = getattr(response, "output", None) or response.get("output")
+    embeddings = None
+    if isinstance(output, dict):
+        embeddings = output.get("embeddings")
+    else:
+        embeddings = getattr(output, "embeddings", None)
+    for position, item in enumerate(embeddings or []):
+        if isinstance(item, dict):
+            index = item.get("text_index", position)
+            vector = item.get("embedding")
+        else:
+            index = getattr(item, "text_index", position)
+            vector = getattr(item, "embedding", None)
+        if isinstance(index, int) and 0 <= index < len(texts):
+            results[index] = vector
+    return results
 
 
 def analyze_note(
@@ -486,7 +711,7 @@ def analyze_note(
         HAS_DASHSCOPE,
     )
     category_options = _normalize_category_options(categories)
-    category_hint = json.dumps(category_options)
+    category_hint = json_utils.dumps(category_options)
     if dashscope_ready:
         prompt = (
             "Analyze the note and respond in JSON with keys: "
@@ -535,34 +760,128 @@ def analyze_note(
     }
 
 
+# Shared so concurrent bulk jobs together stay within AI_CONCURRENCY requests.
+_analysis_executor = ThreadPoolExecutor(max_workers=AI_CONCURRENCY, thread_name_prefix="ai-analyze")
+
+
+def analyze_notes(
+    contents: List[str],
+    categories: Optional[List[str]] = None,
+    use_ai: bool = False,
+) -> List[Any]:
+    """
+    analyze_note for several notes, with up to AI_CONCURRENCY LLM calls in flight.
+
+    Results keep the input order; a note whose analysis raised gets the
+    exception in its slot so callers can fail just that note.
+    """
+    if len(contents) < 2 or not _llm_allowed(use_ai):
+        # The heuristic fallback is CPU-bound and gains nothing from threads.
+        results: List[Any] = []
+        for content in contents:
+            try:
+                results.append(analyze_note(content, categories=categories, use_ai=use_ai))
+            except Exception as exc:
+                results.append(exc)
+        return results
+    futures = [
+        _analysis_executor.submit(analyze_note, content, categories=categories, use_ai=use_ai)
+        for content in contents
+    ]
+    return [future.exception() or future.result() for future in futures]
+
+
+def _embed_batch(batch: List[str]) -> List[Optional[List[float]]]:
+    vectors: List[Optional[List[float]]] = [None] * len(batch)
+    if _dashscope_ready():
+        try:
+            vectors = _dashscope_embeddings(batch)
+        except Exception:
+            logger.exception("DashScope embedding request failed for %s texts", len(batch))
+    missing = [index for index, vector in enumerate(vectors) if not vector]
+    if missing:
+        fallback = _openai_embeddings([batch[index] for index in missing])
+        for index, vector in zip(missing, fallback):
+            vectors[index] = vector
+    return vectors
+
+
+def get_embeddings(
+    texts: List[str],
+    already_anonymized: bool = False,
+    use_ai: bool = False,
+) -> List[Optional[List[float]]]:
+    """Embed several texts with one provider request per EMBED_BATCH_SIZE inputs."""
+    results: List[Optional[List[float]]] = [None] * len(texts)
+    if not texts or not _llm_allowed(use_ai):
+        return results
+    embedding_texts = texts
+    if not already_anonymized:
+        embedding_texts = [anonymize_sensitive_data(text)[0] for text in texts]
+    for start in range(0, len(embedding_texts), EMBED_BATCH_SIZE):
+        batch = embedding_texts[start : start + EMBED_BATCH_SIZE]
+        vectors = _embed_batch(batch)
+        if len(batch) > 1 and not any(vectors):
+            # A single bad input can get the whole batch rejected, so retry the
+            # texts one by one; two failures with no success means the provider
+            # itself is failing and the rest would only wait out timeouts.
+            failures = 0
+            for index, text in enumerate(batch):
+                vectors[index] = _embed_batch([text])[0]
+                if not vectors[index]:
+                    failures += 1
+                    if failures >= 2 and not any(vectors):
+                        break
+        results[start : start + len(batch)] = vectors
+    return results
+
+
 def get_embedding(
     text: str,
     already_anonymized: bool = False,
     use_ai: bool = False,
 ) -> Optional[List[float]]:
+    return get_embeddings([text], already_anonymized=already_anonymized, use_ai=use_ai)[0]
+
+
+def embedding_source_digest(text: str) -> str:
+    """
+    Fingerprint of an anonymized embedding source under the configured model.
+
+    Placeholder ids are random per anonymization, so they are blanked out first;
+    the same note text then hashes the same across runs and restarts.
+    """
+    normalized = ANON_PLACEHOLDER_SCAN_PATTERN.sub("ANON", text)
+    payload = "\0".join((LLM_PROVIDER, LLM_EMBED_MODEL, normalized))
+    return hashlib.blake2b(payload.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+def get_query_embedding(text: str, use_ai: bool = False) -> Optional[List[float]]:
+    """get_embedding for search queries, memoized; callers must not mutate the result."""
     if not _llm_allowed(use_ai):
         return None
-    embedding_text = text
-    if not already_anonymized:
-        embedding_text, _ = anonymize_sensitive_data(text)
-    if _dashscope_ready():
-        response = dashscope.TextEmbedding.call(
-            model=LLM_EMBED_MODEL or dashscope.TextEmbedding.Models.text_embedding_v1,
-            input=embedding_text,
-        )
-        if response.status_code == 200:
-            output = getattr(response, "output", None) or response.get("output")
-            embeddings = None
-            if isinstance(output, dict):
-                embeddings = output.get("embeddings")
-            else:
-                embeddings = getattr(output, "embeddings", None)
-            if embeddings:
-                first = embeddings[0]
-                if isinstance(first, dict):
-                    return first.get("embedding")
-                return getattr(first, "embedding", None)
-    return _openai_embedding(embedding_text)
+    # Queries differing only in spacing share one entry; case is kept, since
+    # embeddings can tell "US" from "us".
+    text = " ".join(text.split())
+    cached = _query_cache_get(_query_embedding_cache, text)
+    if cached is not None:
+        return cached
+    embedding = get_embedding(text, use_ai=use_ai)
+    if embedding:
+        _query_cache_put(_query_embedding_cache, text, embedding)
+    return embedding
+
+
+def _anonymize_notes(notes: List[str]) -> Tuple[List[str], Dict[str, str]]:
+    # Each distinct text is scanned once; duplicates reuse its placeholders.
+    # Stays serial: the re matcher holds the GIL, so threads would not overlap.
+    anonymized_by_text: Dict[str, str] = {}
+    mapping: Dict[str, str] = {}
+    for note in dict.fromkeys(notes):
+        anonymized_note, note_mapping = anonymize_sensitive_data(note)
+        anonymized_by_text[note] = anonymized_note
+        mapping.update(note_mapping)
+    return [anonymized_by_text[note] for note in notes], mapping
 
 
 def summarize_notes(notes: List[str], days: int, use_ai: bool = False) -> str:
@@ -571,12 +890,7 @@ def summarize_notes(notes: List[str], days: int, use_ai: bool = False) -> str:
     if not _llm_allowed(use_ai):
         joined_original = "\n".join(notes)
         return f"Summary ({days} days): " + (joined_original[:400] + "...")
-    mapping: Dict[str, str] = {}
-    anonymized_notes: List[str] = []
-    for note in notes:
-        anonymized_note, note_mapping = anonymize_sensitive_data(note)
-        anonymized_notes.append(anonymized_note)
-        mapping.update(note_mapping)
+    anonymized_notes, mapping = _anonymize_notes(notes)
     joined = "\n".join(anonymized_notes)
     joined_original = "\n".join(notes)
     if _dashscope_ready():
@@ -604,14 +918,9 @@ def answer_question(question: str, notes: List[str], use_ai: bool = False) -> st
         return "No matching notes found."
     if not _llm_allowed(use_ai):
         return notes[0][:200]
-    mapping: Dict[str, str] = {}
-    anonymized_question, question_mapping = anonymize_sensitive_data(question)
-    mapping.update(question_mapping)
-    anonymized_notes: List[str] = []
-    for note in notes:
-        anonymized_note, note_mapping = anonymize_sensitive_data(note)
-        anonymized_notes.append(anonymized_note)
-        mapping.update(note_mapping)
+    anonymized_question, mapping = anonymize_sensitive_data(question)
+    anonymized_notes, notes_mapping = _anonymize_notes(notes)
+    mapping.update(notes_mapping)
     if _dashscope_ready():
         prompt = (
             "Answer the question using the notes.\n"
@@ -641,7 +950,7 @@ def generate_taxonomy_suggestion(micro_clusters: List[Dict[str, Any]], use_ai: b
         return {"error": "AI not enabled"}
 
     # Format the input for LLM
-    cluster_text = json.dumps(micro_clusters, ensure_ascii=False, indent=2)
+    cluster_text = json_utils.dumps(micro_clusters, indent=True)
     
     prompt = (
         "You are an expert knowledge organizer. I have grouped a user's notes into small 'micro-clusters' based on similarity. "
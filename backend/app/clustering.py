@@ -1,21 +1,66 @@
-import math
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
 def cosine_similarity(v1: List[float], v2: List[float]) -> float:
     """Compute cosine similarity between two vectors."""
-    if not v1 or not v2 or len(v1) != len(v2):
+    a = np.asarray(v1, dtype=np.float32)
+    b = np.asarray(v2, dtype=np.float32)
+    if a.size == 0 or a.shape != b.shape:
         return 0.0
-    
-    dot_product = sum(a * b for a, b in zip(v1, v2))
-    norm_a = math.sqrt(sum(a * a for a in v1))
-    norm_b = math.sqrt(sum(b * b for b in v2))
-    
+
+    norm_a = float(np.linalg.norm(a))
+    norm_b = float(np.linalg.norm(b))
     if norm_a == 0 or norm_b == 0:
         return 0.0
-    return dot_product / (norm_a * norm_b)
+    return float(a @ b) / (norm_a * norm_b)
+
+class _LeaderMatrix:
+    """
+    Leader vectors stacked row-wise, so a note is scored against every cluster
+    in a single matrix-vector product.
+
+    Rows are L2-normalized and quantized to int8 with a per-row scale, which
+    keeps the matrix at a quarter of the float32 size. Products accumulate in
+    int32 (int8 * int8 sums overflow int16 at typical embedding sizes).
+    """
+
+    def __init__(self, dim: int, capacity: int = 16):
+        self.vectors = np.empty((capacity, dim), dtype=np.int8)
+        self.scales = np.empty(capacity, dtype=np.float32)
+        self.cluster_indices: List[int] = []
+
+    @staticmethod
+    def _quantize(vec: np.ndarray) -> Tuple[np.ndarray, float]:
+        norm = float(np.linalg.norm(vec))
+        if norm == 0:
+            return np.zeros(vec.shape[0], dtype=np.int8), 0.0
+        unit = vec / norm
+        scale = float(np.abs(unit).max()) / 127.0
+        return np.round(unit / scale).astype(np.int8), scale
+
+    def add(self, vec: np.ndarray, cluster_index: int) -> None:
+        count = len(self.cluster_indices)
+        if count == self.vectors.shape[0]:
+            self.vectors = np.concatenate([self.vectors, np.empty_like(self.vectors)])
+            self.scales = np.concatenate([self.scales, np.empty_like(self.scales)])
+        self.vectors[count], self.scales[count] = self._quantize(vec)
+        self.cluster_indices.append(cluster_index)
+
+    def best_match(self, vec: np.ndarray) -> Tuple[Optional[int], float]:
+        count = len(self.cluster_indices)
+        quantized, scale = self._quantize(vec)
+        if count == 0 or scale == 0:
+            return None, 0.0
+        dots = self.vectors[:count].astype(np.int32) @ quantized.astype(np.int32)
+        # Zero-vector leaders carry a zero scale, so they score 0 like cosine_similarity.
+        sims = dots * self.scales[:count] * scale
+        best = int(sims.argmax())
+        return self.cluster_indices[best], float(sims[best])
+
 
 class LeaderFollowerClusterer:
     """
@@ -34,26 +79,29 @@ class LeaderFollowerClusterer:
         #   }
         # ]
         self.clusters: List[Dict[str, Any]] = []
+        # One leader matrix per embedding dimension (vectors of different
+        # lengths never match, as in cosine_similarity).
+        self._leaders: Dict[int, _LeaderMatrix] = {}
 
     def add_note(self, note: Dict[str, Any]):
         """
         Add a note to the clusters.
         note expected format: {"id": ..., "embedding": [...], "title": ...}
+        The embedding may be a list or a 1-D numpy array.
         """
         vec = note.get("embedding")
-        if not vec:
+        if vec is None or len(vec) == 0:
             logger.warning(f"Note {note.get('id')} has no embedding, skipping clustering.")
             return
 
-        best_cluster = None
-        best_sim = -1.0
-
         # Find best matching cluster
-        for cluster in self.clusters:
-            sim = cosine_similarity(vec, cluster["centroid"])
-            if sim > self.threshold and sim > best_sim:
-                best_sim = sim
-                best_cluster = cluster
+        vec_array = np.asarray(vec, dtype=np.float32)
+        best_cluster = None
+        leaders = self._leaders.get(vec_array.shape[0])
+        if leaders is not None:
+            best_index, best_sim = leaders.best_match(vec_array)
+            if best_index is not None and best_sim > self.threshold:
+                best_cluster = self.clusters[best_index]
 
         if best_cluster:
             # Add to existing cluster
@@ -74,6 +122,10 @@ class LeaderFollowerClusterer:
                 "leader_title": note.get("title", "Untitled")
             }
             self.clusters.append(new_cluster)
+            dim = vec_array.shape[0]
+            if dim not in self._leaders:
+                self._leaders[dim] = _LeaderMatrix(dim)
+            self._leaders[dim].add(vec_array, new_cluster["id"])
 
     def get_clusters(self) -> List[Dict[str, Any]]:
         return self.clusters
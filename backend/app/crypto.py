@@ -1,5 +1,7 @@
 import base64
 import os
+from functools import lru_cache
+from typing import Iterable, List
 
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
@@ -10,6 +12,10 @@ def generate_salt() -> str:
     return base64.b64encode(os.urandom(16)).decode("ascii")
 
 
+# PBKDF2 costs tens of milliseconds by design and every authenticated request
+# needs the key. The output depends only on these two stored values, so
+# changing the password (and with it the hash) yields a new cache entry.
+@lru_cache(maxsize=1024)
 def derive_key(password_hash: str, salt_b64: str) -> bytes:
     salt = base64.b64decode(salt_b64)
     kdf = PBKDF2HMAC(
@@ -21,8 +27,15 @@ def derive_key(password_hash: str, salt_b64: str) -> bytes:
     return kdf.derive(password_hash.encode("utf-8"))
 
 
+# Building an AESGCM validates and copies the key, which costs more than
+# decrypting a typical note; keys come from derive_key, so they are few.
+@lru_cache(maxsize=1024)
+def _cipher(key: bytes) -> AESGCM:
+    return AESGCM(key)
+
+
 def encrypt_content(plaintext: str, key: bytes) -> str:
-    aesgcm = AESGCM(key)
+    aesgcm = _cipher(key)
     nonce = os.urandom(12)
     ciphertext = aesgcm.encrypt(nonce, plaintext.encode("utf-8"), None)
     return base64.b64encode(nonce + ciphertext).decode("ascii")
@@ -31,6 +44,16 @@ def encrypt_content(plaintext: str, key: bytes) -> str:
 def decrypt_content(encrypted: str, key: bytes) -> str:
     data = base64.b64decode(encrypted)
     nonce, ciphertext = data[:12], data[12:]
-    aesgcm = AESGCM(key)
+    aesgcm = _cipher(key)
     plaintext = aesgcm.decrypt(nonce, ciphertext, None)
     return plaintext.decode("utf-8")
+
+
+def decrypt_contents(encrypted: Iterable[str], key: bytes) -> List[str]:
+    """decrypt_content for many values under one key."""
+    aesgcm = _cipher(key)
+    plaintexts = []
+    for value in encrypted:
+        data = base64.b64decode(value)
+        plaintexts.append(aesgcm.decrypt(data[:12], data[12:], None).decode("utf-8"))
+    return plaintexts
@@ -1,8 +1,9 @@
 import os
 import sys
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import QueuePool
 
 
 def get_base_dir():
@@ -23,11 +24,48 @@ else:
 
 DATABASE_URL = os.getenv("DATABASE_URL", DEFAULT_DB_URL)
 
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+# Sized for the FastAPI threadpool; overflow connections are closed when returned.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
 connect_args = {}
-if DATABASE_URL.startswith("sqlite"):
+engine_kwargs = {}
+if IS_SQLITE:
     connect_args = {"check_same_thread": False}
+    if ":memory:" not in DATABASE_URL:
+        # SQLAlchemy 1.4 gives file databases a NullPool, which reopens the file for
+        # every session and throws away the page cache and per-connection PRAGMAs.
+        engine_kwargs = {
+            "poolclass": QueuePool,
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+        }
+else:
+    engine_kwargs = {
+        "pool_pre_ping": True,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+    }
+
+engine = create_engine(DATABASE_URL, connect_args=connect_args, **engine_kwargs)
+
+
+if IS_SQLITE:
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, _connection_record):
+        # Only journal_mode is stored in the file; the rest must be set per connection.
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA cache_size=-64000")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")  # 256MB memory-mapped I/O
+        cursor.execute("PRAGMA wal_autocheckpoint=1000")  # Checkpoint every 1000 pages
+        cursor.execute("PRAGMA busy_timeout=5000")  # 5 second timeout for locks
+        cursor.close()
 
-engine = create_engine(DATABASE_URL, connect_args=connect_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -0,0 +1,181 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import json_utils, models
+
+EMBEDDING_INDEX_MAX_USERS = int(os.getenv("EMBEDDING_INDEX_MAX_USERS", "64"))
+# Keep cached matrices as int8 with a per-row scale: a quarter of the memory, at
+# the cost of slower scoring (numpy has no int8 BLAS) and ~1e-3 similarity error.
+EMBEDDING_INDEX_INT8 = os.getenv("EMBEDDING_INDEX_INT8", "false").strip().lower() in (
+    "1",
+    "true",
+    "yes",
+    "on",
+)
+
+
+# Embeddings are stored as raw little-endian float32 bytes.
+_STORED_DTYPE = np.dtype("<f4")
+
+
+def pack_vector(values: Iterable[float]) -> bytes:
+    """Encode an embedding for the notes.embedding BLOB column."""
+    return np.asarray(values, dtype=_STORED_DTYPE).tobytes()
+
+
+def parse_vector(raw: Union[bytes, str, None]) -> Optional[np.ndarray]:
+    """Decode a stored embedding into a float32 vector (None if unusable).
+
+    Accepts the float32 BLOB format as well as the legacy JSON-text format.
+    """
+    if not raw:
+        return None
+    if isinstance(raw, (bytes, bytearray, memoryview)):
+        if len(raw) % _STORED_DTYPE.itemsize:
+            return None
+        return np.frombuffer(raw, dtype=_STORED_DTYPE).astype(np.float32, copy=False)
+    try:
+        data = json_utils.loads(raw)
+    except (json_utils.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(data, list):
+        return None
+    try:
+        vector = np.asarray(data, dtype=np.float32)
+    except (TypeError, ValueError):
+        # Mixed content: keep just the numeric entries.
+        vector = np.asarray(
+            [value for value in data if isinstance(value, (int, float))], dtype=np.float32
+        )
+    if vector.ndim != 1 or not vector.size:
+        return None
+    return vector
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    # Zero vectors stay zero, so they score 0.0 against any query.
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def _quantize_rows(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    safe = np.where(scales == 0, 1.0, scales)[:, None]
+    return np.round(matrix / safe).astype(np.int8), scales.astype(np.float32)
+
+
+class NoteEmbeddingIndex:
+    """
+    One user's note embeddings as L2-normalized float32 matrices, so ranking a
+    query against every note is a single matrix-vector product.
+
+    Rows are grouped by dimension: notes embedded by a different model simply
+    score 0.0 against the query, matching the pure-Python cosine helper. With
+    quantize=True rows are held as int8 plus a per-row scale.
+    """
+
+    def __init__(
+        self,
+        note_ids: Iterable[int],
+        vectors: Dict[int, np.ndarray],
+        version: int,
+        quantize: bool = False,
+    ):
+        # Every note seen at build time, with or without an embedding; used to
+        # notice notes created since the index was built.
+        self.note_ids = frozenset(note_ids)
+        self.version = version
+        self._groups: Dict[int, Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]] = {}
+        self._rows: Dict[int, Tuple[int, int]] = {}
+        by_dim: Dict[int, List[Tuple[int, np.ndarray]]] = {}
+        for note_id, vector in vectors.items():
+            by_dim.setdefault(vector.shape[0], []).append((note_id, vector))
+        for dim, entries in by_dim.items():
+            ids = np.fromiter((note_id for note_id, _ in entries), dtype=np.int64, count=len(entries))
+            matrix = _normalize_rows(np.stack([vector for _, vector in entries]))
+            scales = None
+            if quantize:
+                matrix, scales = _quantize_rows(matrix)
+            self._groups[dim] = (ids, matrix, scales)
+            for row, (note_id, _) in enumerate(entries):
+                self._rows[note_id] = (dim, row)
+
+    def has_embedding(self, note_id: int) -> bool:
+        return note_id in self._rows
+
+    def vector(self, note_id: int) -> Optional[np.ndarray]:
+        position = self._rows.get(note_id)
+        if position is None:
+            return None
+        dim, row = position
+        _, matrix, scales = self._groups[dim]
+        if scales is not None:
+            return matrix[row].astype(np.float32) * scales[row]
+        return matrix[row]
+
+    def similarities(self, query: Iterable[float]) -> Dict[int, float]:
+        """Cosine similarity of the query against every note with a same-sized embedding."""
+        q = np.asarray(query, dtype=np.float32)
+        group = self._groups.get(q.shape[0]) if q.ndim == 1 else None
+        if group is None:
+            return {}
+        norm = float(np.linalg.norm(q))
+        if norm == 0:
+            return {}
+        ids, matrix, scales = group
+        # int8 rows are upcast to float32 inside the product, then rescaled.
+        sims = matrix @ (q / norm)
+        if scales is not None:
+            sims *= scales
+        return dict(zip(ids.tolist(), sims.tolist()))
+
+
+# user_id -> index; most recently used last.
+_indexes: "OrderedDict[int, NoteEmbeddingIndex]" = OrderedDict()
+_versions: Dict[int, int] = {}
+_lock = threading.Lock()
+
+
+def _build(db: Session, user_id: int, version: int) -> NoteEmbeddingIndex:
+    rows = db.query(models.Note.id, models.Note.embedding).filter(models.Note.user_id == user_id)
+    note_ids: List[int] = []
+    vectors: Dict[int, np.ndarray] = {}
+    for note_id, raw in rows:
+        note_ids.append(note_id)
+        vector = parse_vector(raw)
+        if vector is not None:
+            vectors[note_id] = vector
+    return NoteEmbeddingIndex(note_ids, vectors, version, quantize=EMBEDDING_INDEX_INT8)
+
+
+def get_index(db: Session, user_id: int, note_ids: Iterable[int] = ()) -> NoteEmbeddingIndex:
+    """Return the user's cached index, rebuilding it if stale or missing any of note_ids."""
+    with _lock:
+        version = _versions.get(user_id, 0)
+        index = _indexes.get(user_id)
+        if index is not None and index.version == version and index.note_ids.issuperset(note_ids):
+            _indexes.move_to_end(user_id)
+            return index
+    index = _build(db, user_id, version)
+    with _lock:
+        # An invalidation during the build means the rows read may already be old.
+        if _versions.get(user_id, 0) == version and EMBEDDING_INDEX_MAX_USERS > 0:
+            _indexes[user_id] = index
+            _indexes.move_to_end(user_id)
+            while len(_indexes) > EMBEDDING_INDEX_MAX_USERS:
+                _indexes.popitem(last=False)
+    return index
+
+
+def invalidate(user_id: int) -> None:
+    """Drop the user's index; call after committing any change to their notes' embeddings."""
+    with _lock:
+        _versions[user_id] = _versions.get(user_id, 0) + 1
+        _indexes.pop(user_id, None)
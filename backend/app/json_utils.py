@@ -0,0 +1,29 @@
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+
+    HAS_ORJSON = True
+except ImportError:  # pragma: no cover - optional dependency
+    HAS_ORJSON = False
+
+
+# orjson.JSONDecodeError subclasses this, so one except clause covers both.
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(raw: Union[str, bytes]) -> Any:
+    """Parse JSON, using orjson when it is installed."""
+    if HAS_ORJSON:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def dumps(value: Any, indent: bool = False) -> str:
+    """Serialize to compact (or 2-space indented) JSON, keeping non-ASCII text as-is."""
+    if HAS_ORJSON:
+        return orjson.dumps(value, option=orjson.OPT_INDENT_2 if indent else 0).decode("utf-8")
+    if indent:
+        return json.dumps(value, ensure_ascii=False, indent=2)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
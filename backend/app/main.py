@@ -1,25 +1,39 @@
 import csv
+import hashlib
+import heapq
 import json
 import logging
 import mimetypes
 import os
 import re
 import secrets
-import shutil
 import sys
+from collections import defaultdict
+from functools import lru_cache
 from io import BytesIO, StringIO
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, DefaultDict, Dict, List, Optional, Set, Tuple
 from .time_utils import ensure_beijing_tz, now_beijing
 
-from fastapi import Depends, FastAPI, File, Form, HTTPException, Query, Request, Response, UploadFile, status
+import numpy as np
+from fastapi import BackgroundTasks, Depends, FastAPI, File, Form, HTTPException, Query, Request, Response, UploadFile, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import func, inspect, or_, text
-from sqlalchemy.orm import Session, defer
-
-from . import ai, clustering, crypto, models, schemas, security
+from sqlalchemy import LargeBinary, and_, column, func, inspect, literal_column, not_, or_, text
+from sqlalchemy.orm import Session, defer, joinedload, raiseload
+
+from . import (
+    ai,
+    clustering,
+    crypto,
+    embedding_index,
+    json_utils,
+    models,
+    schemas,
+    search_cache,
+    security,
+)
 from .database import DATABASE_URL, SessionLocal, engine
 
 try:
@@ -45,9 +59,16 @@ AI_FEATURE_ENABLED = os.getenv("AI_ENABLED", "false").strip().lower() in (
 ANON_TAG_PATTERN = re.compile(r"anon_[0-9a-f]{8}", re.IGNORECASE)
 RELATED_KEYWORD_LIMIT = int(os.getenv("RELATED_KEYWORD_LIMIT", "12"))
 RELATED_DEFAULT_LIMIT = int(os.getenv("RELATED_NOTES_LIMIT", "6"))
-WORD_TOKEN_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{2,}")
-CJK_TOKEN_PATTERN = re.compile(r"[\u4e00-\u9fff]{2,}")
+# Notes /api/ai/ask hands to the model as context.
+AI_ASK_NOTE_LIMIT = 50
+# Word and CJK runs use disjoint character classes, so one scan finds both.
+KEYWORD_TOKEN_PATTERN = re.compile(
+    r"(?P<word>[A-Za-z0-9][A-Za-z0-9_-]{2,})|(?P<cjk>[\u4e00-\u9fff]{2,})"
+)
+CJK_BIGRAM_PATTERN = re.compile(r"(?=([\u4e00-\u9fff]{2}))")
 ATTACHMENT_REF_PATTERN = re.compile(r"/api/attachments/(\d+)")
+# FTS5 indexes only letters and digits; tags without any skip the index.
+TAG_WORD_PATTERN = re.compile(r"[^\W_]")
 DEFAULT_CATEGORIES = [
     {"key": "credential", "label": "Credentials"},
     {"key": "work", "label": "Work"},
@@ -66,103 +87,43 @@ else:
 
 UPLOAD_DIR = os.path.abspath(os.getenv("UPLOAD_DIR", os.path.join(_STORAGE_ROOT, "storage")))
 MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "20"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 AUTH_COOKIE_NAME = os.getenv("AUTH_COOKIE_NAME", "access_token")
 COOKIE_SECURE = os.getenv("COOKIE_SECURE", "false").strip().lower() in ("1", "true", "yes", "on")
 
 models.Base.metadata.create_all(bind=engine)
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# SQLite performance optimizations
-if DATABASE_URL.startswith("sqlite"):
-    with engine.begin() as connection:
-        connection.execute(text("PRAGMA journal_mode=WAL"))
-        connection.execute(text("PRAGMA synchronous=NORMAL"))
-        connection.execute(text("PRAGMA cache_size=-64000"))
-        connection.execute(text("PRAGMA temp_store=MEMORY"))
-        connection.execute(text("PRAGMA mmap_size=268435456"))  # 256MB memory-mapped I/O
-        connection.execute(text("PRAGMA wal_autocheckpoint=1000"))  # Checkpoint every 1000 pages
-        connection.execute(text("PRAGMA busy_timeout=5000"))  # 5 second timeout for locks
-        # Update query planner statistics
-        connection.execute(text("ANALYZE"))
-
-
-def _ensure_notes_title_column() -> None:
-    inspector = inspect(engine)
-    if "notes" not in inspector.get_table_names():
-        return
-    columns = {column["name"] for column in inspector.get_columns("notes")}
-    if "title" in columns:
-        return
-    with engine.begin() as connection:
-        connection.execute(text("ALTER TABLE notes ADD COLUMN title VARCHAR"))
-
-
-_ensure_notes_title_column()
-
-
-def _ensure_notes_short_title_column() -> None:
-    inspector = inspect(engine)
-    if "notes" not in inspector.get_table_names():
-        return
-    columns = {column["name"] for column in inspector.get_columns("notes")}
-    if "short_title" in columns:
-        return
-    with engine.begin() as connection:
-        connection.execute(text("ALTER TABLE notes ADD COLUMN short_title VARCHAR"))
-
-
-_ensure_notes_short_title_column()
-
-
-def _ensure_notes_completed_column() -> None:
-    inspector = inspect(engine)
-    if "notes" not in inspector.get_table_names():
-        return
-    columns = {column["name"] for column in inspector.get_columns("notes")}
-    if "completed" in columns:
-        return
-    with engine.begin() as connection:
-        connection.execute(text("ALTER TABLE notes ADD COLUMN completed BOOLEAN DEFAULT 0"))
-
-
-_ensure_notes_completed_column()
+# Columns added to notes after its first release, with their DDL types.
+NOTES_ADDED_COLUMNS = (
+    ("title", "VARCHAR"),
+    ("short_title", "VARCHAR"),
+    ("completed", "BOOLEAN DEFAULT 0"),
+    ("folder", "VARCHAR"),
+    ("pinned_global", "BOOLEAN DEFAULT 0"),
+    ("pinned_category", "BOOLEAN DEFAULT 0"),
+    ("pinned_at", "DATETIME"),
+    ("search_text", "TEXT"),
+    ("embedding_source_hash", "VARCHAR"),
+    ("embedding_token", "VARCHAR"),
+)
+# Timeline bucket formats; each has a matching expression index (SQLite only).
+TIMELINE_FORMATS = {"month": "%Y-%m", "day": "%Y-%m-%d"}
+# Bump when adding a migration below. SQLite databases record it in
+# PRAGMA user_version and skip the schema inspection on later starts.
+SCHEMA_VERSION = 9
 
 
-def _ensure_notes_folder_column() -> None:
-    inspector = inspect(engine)
-    if "notes" not in inspector.get_table_names():
-        return
-    columns = {column["name"] for column in inspector.get_columns("notes")}
-    if "folder" in columns:
+def _ensure_notes_columns(columns: Set[str]) -> None:
+    missing = [(name, ddl) for name, ddl in NOTES_ADDED_COLUMNS if name not in columns]
+    if not missing:
         return
     with engine.begin() as connection:
-        connection.execute(text("ALTER TABLE notes ADD COLUMN folder VARCHAR"))
+        for name, ddl in missing:
+            connection.execute(text(f"ALTER TABLE notes ADD COLUMN {name} {ddl}"))
 
 
-_ensure_notes_folder_column()
-
-
-def _ensure_notes_pinning_columns() -> None:
-    inspector = inspect(engine)
-    if "notes" not in inspector.get_table_names():
-        return
-    columns = {column["name"] for column in inspector.get_columns("notes")}
-    
-    with engine.begin() as connection:
-        if "pinned_global" not in columns:
-            connection.execute(text("ALTER TABLE notes ADD COLUMN pinned_global BOOLEAN DEFAULT 0"))
-        if "pinned_category" not in columns:
-            connection.execute(text("ALTER TABLE notes ADD COLUMN pinned_category BOOLEAN DEFAULT 0"))
-        if "pinned_at" not in columns:
-            connection.execute(text("ALTER TABLE notes ADD COLUMN pinned_at DATETIME"))
-
-
-_ensure_notes_pinning_columns()
-
 def _ensure_notes_indexes() -> None:
-    inspector = inspect(engine)
-    if "notes" not in inspector.get_table_names():
-        return
     with engine.begin() as connection:
         connection.execute(
             text(
@@ -182,26 +143,206 @@ def _ensure_notes_indexes() -> None:
                 "ON notes(user_id, completed, created_at)"
             )
         )
+        # rebuild_embeddings and random_note walk a user's notes by id; without
+        # this the matching rows are sorted in a temp B-tree on every page.
+        connection.execute(
+            text("CREATE INDEX IF NOT EXISTS idx_notes_user_id ON notes(user_id, id)")
+        )
         connection.execute(
             text(
                 "CREATE INDEX IF NOT EXISTS idx_notes_completed "
                 "ON notes(completed) WHERE completed IS NOT NULL AND completed = 1"
             )
         )
+        if DATABASE_URL.startswith("sqlite"):
+            for group, fmt in TIMELINE_FORMATS.items():
+                connection.execute(
+                    text(
+                        f"CREATE INDEX IF NOT EXISTS idx_notes_user_{group} "
+                        f"ON notes(user_id, strftime('{fmt}', created_at), completed)"
+                    )
+                )
+            # Cover the pinned halves of list_notes (see _pinned_first_page). SQLite
+            # only uses a partial index when the query repeats its WHERE terms, so
+            # these spell out the filters exactly as SQLAlchemy renders them.
+            connection.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS idx_notes_user_pinned ON notes(user_id) "
+                    "WHERE pinned_global IS 1 OR pinned_at IS NOT NULL"
+                )
+            )
+            connection.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS idx_notes_user_category_pinned "
+                    "ON notes(user_id, ai_category) "
+                    "WHERE pinned_category IS 1 OR pinned_global IS 1 OR pinned_at IS NOT NULL"
+                )
+            )
+
+
+def _ensure_notes_embedding_blobs(embedding_type: Any) -> None:
+    # Embeddings used to be stored as JSON text; convert any left in that format
+    # to float32 BLOBs. SQLite keeps the BLOB as-is in the old TEXT column.
+    if not DATABASE_URL.startswith("sqlite"):
+        if not isinstance(embedding_type, LargeBinary):
+            _convert_notes_embedding_column()
+        return
+    with engine.begin() as connection:
+        rows = connection.execute(
+            text("SELECT id, embedding FROM notes WHERE typeof(embedding) = 'text'")
+        ).fetchall()
+        if not rows:
+            return
+        updates = []
+        for note_id, raw in rows:
+            vector = embedding_index.parse_vector(raw)
+            updates.append(
+                {"id": note_id, "embedding": vector.tobytes() if vector is not None else None}
+            )
+        connection.execute(
+            text("UPDATE notes SET embedding = :embedding WHERE id = :id"), updates
+        )
+    logger.info("Converted %s note embeddings from JSON to float32 BLOBs", len(updates))
 
 
-_ensure_notes_indexes()
+def _convert_notes_embedding_column() -> None:
+    # Other databases reject bytes in the old TEXT column, so the column is
+    # recreated with the binary type and the parsed vectors written back.
+    blob_type = LargeBinary().compile(dialect=engine.dialect)
+    try:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                text("SELECT id, embedding FROM notes WHERE embedding IS NOT NULL")
+            ).fetchall()
+            connection.execute(text("ALTER TABLE notes DROP COLUMN embedding"))
+            connection.execute(text(f"ALTER TABLE notes ADD COLUMN embedding {blob_type}"))
+            updates = []
+            for note_id, raw in rows:
+                vector = embedding_index.parse_vector(raw)
+                if vector is not None:
+                    updates.append({"id": note_id, "embedding": vector.tobytes()})
+            if updates:
+                connection.execute(
+                    text("UPDATE notes SET embedding = :embedding WHERE id = :id"), updates
+                )
+    except Exception as e:
+        raise RuntimeError(
+            f"notes.embedding must be converted from JSON text to {blob_type}; "
+            "automatic conversion failed. Convert the column (or set it to NULL and "
+            f"rebuild embeddings from the app) and restart: {e}"
+        ) from e
+    logger.info("Converted %s note embeddings from JSON to %s", len(updates), blob_type)
+
+
+def _ensure_notes_search_text(rebuild_all: bool = False) -> None:
+    # Backfill the write-time search text for notes saved before the column
+    # existed; rebuild_all also rewrites rows built with an older field separator.
+    query = (
+        "SELECT id, title, short_title, ai_summary, ai_tags, ai_entities FROM notes"
+        if rebuild_all
+        else "SELECT id, title, short_title, ai_summary, ai_tags, ai_entities "
+        "FROM notes WHERE search_text IS NULL"
+    )
+    with engine.begin() as connection:
+        rows = connection.execute(text(query)).fetchall()
+        if not rows:
+            return
+        connection.execute(
+            text("UPDATE notes SET search_text = :search_text WHERE id = :id"),
+            [{"id": row[0], "search_text": models.build_search_text(*row[1:])} for row in rows],
+        )
+    logger.info("Built search text for %s notes", len(rows))
+
+
+NOTES_FTS_TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS notes_fts_insert AFTER INSERT ON notes BEGIN "
+    "INSERT INTO notes_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+    "CREATE TRIGGER IF NOT EXISTS notes_fts_delete AFTER DELETE ON notes BEGIN "
+    "INSERT INTO notes_fts(notes_fts, rowid, search_text) "
+    "VALUES ('delete', old.id, old.search_text); END",
+    "CREATE TRIGGER IF NOT EXISTS notes_fts_update AFTER UPDATE OF search_text ON notes BEGIN "
+    "INSERT INTO notes_fts(notes_fts, rowid, search_text) "
+    "VALUES ('delete', old.id, old.search_text); "
+    "INSERT INTO notes_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+)
+
 
-# Periodic ANALYZE for query planner optimization
+def _ensure_notes_fts() -> None:
+    # FTS5 index over the plaintext search_text (never over encrypted content),
+    # kept in sync with notes by triggers.
+    if not DATABASE_URL.startswith("sqlite"):
+        return
+    try:
+        with engine.begin() as connection:
+            connection.execute(
+                text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts "
+                    "USING fts5(search_text, content='notes', content_rowid='id')"
+                )
+            )
+            for trigger in NOTES_FTS_TRIGGERS:
+                connection.execute(text(trigger))
+            connection.execute(text("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')"))
+    except Exception as e:
+        logger.warning(f"SQLite FTS5 unavailable, tag filters will scan: {e}")
+
+
+def _has_notes_fts() -> bool:
+    # The table alone is not enough: without its triggers the index goes stale.
+    if not DATABASE_URL.startswith("sqlite"):
+        return False
+    with engine.connect() as connection:
+        names = {
+            row[0]
+            for row in connection.execute(
+                text("SELECT name FROM sqlite_master WHERE name LIKE 'notes_fts%'")
+            )
+        }
+    return {"notes_fts", "notes_fts_insert", "notes_fts_delete", "notes_fts_update"} <= names
+
+
+def _migrate_schema() -> None:
+    is_sqlite = DATABASE_URL.startswith("sqlite")
+    version = SCHEMA_VERSION
+    if is_sqlite:
+        with engine.connect() as connection:
+            version = connection.execute(text("PRAGMA user_version")).scalar() or 0
+            if version >= SCHEMA_VERSION:
+                return
+    # One inspector for every check instead of a sqlite_master scan per column.
+    inspector = inspect(engine)
+    if "notes" in inspector.get_table_names():
+        columns = {column["name"]: column["type"] for column in inspector.get_columns("notes")}
+        _ensure_notes_columns(set(columns))
+        _ensure_notes_indexes()
+        _ensure_notes_embedding_blobs(columns.get("embedding"))
+        # Search text before version 8 was NUL-joined; notes_fts is rebuilt
+        # from the rewritten column right after.
+        _ensure_notes_search_text(rebuild_all=version < 8)
+        _ensure_notes_fts()
+    if is_sqlite:
+        with engine.begin() as connection:
+            connection.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+
+
+_migrate_schema()
+HAS_NOTES_FTS = _has_notes_fts()
+if DATABASE_URL.startswith("sqlite") and not HAS_NOTES_FTS:
+    # Not covered by user_version: a failed FTS5 setup is logged and skipped by
+    # the migration, so it is retried on every start until it succeeds.
+    _ensure_notes_fts()
+    HAS_NOTES_FTS = _has_notes_fts()
+
+# SQLite connection PRAGMAs are applied per connection in database.py.
+# Full ANALYZE only when no statistics exist yet; afterwards PRAGMA optimize
+# re-analyzes just the tables whose statistics have gone stale.
 if DATABASE_URL.startswith("sqlite"):
     try:
         with engine.begin() as connection:
-            # Check if we need to run ANALYZE (check sqlite_stat1 table age)
-            result = connection.execute(text(
+            has_stats = connection.execute(text(
                 "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='sqlite_stat1'"
             )).scalar()
-            if result == 0:
-                connection.execute(text("ANALYZE"))
+            connection.execute(text("PRAGMA optimize" if has_stats else "ANALYZE"))
     except Exception as e:
         logger.warning(f"Failed to run ANALYZE: {e}")
 
@@ -248,7 +389,14 @@ def get_current_user(
         user_id = int(payload.get("sub"))
     except Exception as exc:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token") from exc
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    # Settings are read on most requests (AI flag, categories); join them in
+    # rather than paying a lazy SELECT later.
+    user = (
+        db.query(models.User)
+        .options(joinedload(models.User.settings))
+        .filter(models.User.id == user_id)
+        .first()
+    )
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
     return user
@@ -319,49 +467,43 @@ def _sync_note_attachments(
             .delete(synchronize_session=False)
         )
 
-        attachments_to_update = (
+        # Attachments whose primary note was this one fall back to their most
+        # recently linked remaining note, in one correlated UPDATE.
+        replacement = (
+            db.query(models.NoteAttachment.note_id)
+            .filter(models.NoteAttachment.attachment_id == models.Attachment.id)
+            .order_by(models.NoteAttachment.created_at.desc())
+            .limit(1)
+            .correlate(models.Attachment)
+            .scalar_subquery()
+        )
+        (
             db.query(models.Attachment)
             .filter(
                 models.Attachment.user_id == current_user.id,
                 models.Attachment.id.in_(list(to_remove)),
                 models.Attachment.note_id == note.id,
             )
-            .all()
+            .update({models.Attachment.note_id: replacement}, synchronize_session=False)
         )
-        for attachment in attachments_to_update:
-            replacement = (
-                db.query(models.NoteAttachment.note_id)
-                .filter(models.NoteAttachment.attachment_id == attachment.id)
-                .order_by(models.NoteAttachment.created_at.desc())
-                .first()
-            )
-            attachment.note_id = replacement[0] if replacement else None
 
     if not to_add:
         return
 
-    owned_ids = {
-        row[0]
-        for row in (
-            db.query(models.Attachment.id)
-            .filter(
-                models.Attachment.user_id == current_user.id,
-                models.Attachment.id.in_(list(to_add)),
-            )
-            .all()
-        )
-    }
-    for attachment_id in owned_ids:
-        db.add(models.NoteAttachment(note_id=note.id, attachment_id=attachment_id))
-
     attachments_added = (
         db.query(models.Attachment)
         .filter(
             models.Attachment.user_id == current_user.id,
-            models.Attachment.id.in_(list(owned_ids)),
+            models.Attachment.id.in_(list(to_add)),
         )
         .all()
     )
+    if not attachments_added:
+        return
+    db.bulk_insert_mappings(
+        models.NoteAttachment,
+        [{"note_id": note.id, "attachment_id": attachment.id} for attachment in attachments_added],
+    )
     for attachment in attachments_added:
         if attachment.note_id is None:
             attachment.note_id = note.id
@@ -371,11 +513,25 @@ def _safe_json_loads(value: Optional[str], default: Any):
     if not value:
         return default
     try:
-        return json.loads(value)
-    except json.JSONDecodeError:
+        return json_utils.loads(value)
+    except json_utils.JSONDecodeError:
         return default
 
 
+def _note_json(note: models.Note, field: str, default: Any) -> Any:
+    # Search parses a note's tags/entities for matching and again for the
+    # response; the parsed value is kept on the instance for as long as the
+    # raw column is unchanged. Callers must not mutate the result.
+    raw = getattr(note, field)
+    parsed = note.__dict__.setdefault("_parsed_json", {})
+    cached = parsed.get(field)
+    if cached is not None and cached[0] is raw:
+        return cached[1]
+    value = _safe_json_loads(raw, default)
+    parsed[field] = (raw, value)
+    return value
+
+
 def _normalize_bool(value: Any) -> bool:
     if isinstance(value, bool):
         return value
@@ -415,9 +571,17 @@ def _normalize_categories(raw: Any) -> List[Dict[str, str]]:
 
 
 def _load_user_settings_payload(user: models.User) -> Dict[str, Any]:
+    """Parsed settings payload; shared between calls, so copy before mutating."""
     if not user.settings or not user.settings.payload:
         return {}
-    payload = _safe_json_loads(user.settings.payload, {})
+    return _parse_settings_payload(user.settings.payload)
+
+
+@lru_cache(maxsize=1024)
+def _parse_settings_payload(raw: str) -> Dict[str, Any]:
+    # Keyed by the raw JSON, so a saved change is a new key and never stale.
+    # Several helpers read settings on every request (categories, ai_enabled).
+    payload = _safe_json_loads(raw, {})
     return payload if isinstance(payload, dict) else {}
 
 
@@ -441,7 +605,7 @@ def _save_tracker_payload(db: Session, user: models.User, payload: Dict[str, Any
     if not isinstance(payload, dict):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid tracker payload")
     try:
-        payload_json = json.dumps(payload, ensure_ascii=False)
+        payload_json = json_utils.dumps(payload)
     except TypeError as exc:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid tracker payload"
@@ -639,17 +803,38 @@ def _select_category(
     return _fallback_category(allowed)
 
 
-def _restore_mapping_in_obj(data: Any, mapping: Dict[str, str]) -> Any:
-    if isinstance(data, str):
-        restored = data
-        for placeholder, original in mapping.items():
-            restored = restored.replace(placeholder, original)
-        return restored
-    if isinstance(data, list):
-        return [_restore_mapping_in_obj(item, mapping) for item in data]
-    if isinstance(data, dict):
-        return {k: _restore_mapping_in_obj(v, mapping) for k, v in data.items()}
-    return data
+def _notes_changed(user_id: int) -> None:
+    # Call after committing any write to the user's notes.
+    embedding_index.invalidate(user_id)
+    search_cache.invalidate(user_id)
+
+
+class _DecryptCache:
+    """Request-scoped plaintext of note contents, so each note is decrypted at most once."""
+
+    def __init__(self, key: bytes):
+        self.key = key
+        self._content: Dict[int, str] = {}
+        self._lowered: Dict[int, str] = {}
+
+    def get(self, note: models.Note) -> str:
+        content = self._content.get(note.id)
+        if content is None:
+            raw = (
+                crypto.decrypt_content(note.content, self.key)
+                if note.content_encrypted
+                else note.content
+            )
+            content = raw or ""
+            self._content[note.id] = content
+        return content
+
+    def lower(self, note: models.Note) -> str:
+        lowered = self._lowered.get(note.id)
+        if lowered is None:
+            lowered = self.get(note).lower()
+            self._lowered[note.id] = lowered
+        return lowered
 
 
 def _note_to_schema(
@@ -657,16 +842,13 @@ def _note_to_schema(
     key: bytes,
     search_info: Optional[schemas.SearchInfo] = None,
     include_content: bool = True,
+    decrypted: Optional[_DecryptCache] = None,
 ) -> schemas.NoteOut:
     content = ""
     if include_content:
-        content = (
-            crypto.decrypt_content(note.content, key) if note.content_encrypted else note.content
-        )
-        if content is None:
-            content = ""
-    tags = _normalize_tags(_safe_json_loads(note.ai_tags, []))
-    entities = _safe_json_loads(note.ai_entities, {})
+        content = (decrypted or _DecryptCache(key)).get(note)
+    tags = _normalize_tags(_note_json(note, "ai_tags", []))
+    entities = _note_json(note, "ai_entities", {})
     if not isinstance(entities, dict):
         entities = {}
     return schemas.NoteOut(
@@ -690,45 +872,19 @@ def _note_to_schema(
     )
 
 
-def _note_matches_query(note: models.Note, query: str, key: bytes) -> bool:
-    query_lower = query.lower()
-    title = note.title or ""
-    if title and query_lower in title.lower():
-        return True
-    short_title = note.short_title or ""
-    if short_title and query_lower in short_title.lower():
-        return True
-    content = crypto.decrypt_content(note.content, key) if note.content_encrypted else note.content
-    if content and query_lower in content.lower():
-        return True
-    summary = note.ai_summary or ""
-    if summary and query_lower in summary.lower():
-        return True
-    tags = _safe_json_loads(note.ai_tags, [])
-    if isinstance(tags, list):
-        if any(query_lower in str(tag).lower() for tag in tags):
-            return True
-    elif isinstance(tags, str) and query_lower in tags.lower():
-        return True
-    entities = _safe_json_loads(note.ai_entities, {})
-    if isinstance(entities, dict):
-        for key_text, value_text in entities.items():
-            if query_lower in str(key_text).lower() or query_lower in str(value_text).lower():
-                return True
-    elif isinstance(entities, str) and query_lower in entities.lower():
-        return True
-    return False
-
-
-def _note_matches_keywords(note: models.Note, keywords: List[str], key: bytes) -> bool:
-    for keyword in keywords:
-        if keyword and _note_matches_query(note, keyword, key):
-            return True
-    return False
+def _note_metadata_text(note: models.Note) -> str:
+    """Lowercased plaintext fields of a note, separator-joined so matches cannot span fields."""
+    # Precomputed on write; only rows not yet flushed fall back to building it here.
+    if note.search_text is not None:
+        return note.search_text
+    return models.build_search_text(
+        note.title, note.short_title, note.ai_summary, note.ai_tags, note.ai_entities
+    )
 
 
-def _note_matching_keywords(note: models.Note, keywords: List[str], key: bytes) -> List[str]:
-    matches: List[str] = []
+def _prepare_keywords(keywords: List[str]) -> List[Tuple[str, str]]:
+    """Stripped (keyword, lowercased) pairs, deduped case-insensitively; built once per query."""
+    prepared: List[Tuple[str, str]] = []
     seen = set()
     for keyword in keywords:
         cleaned = str(keyword or "").strip()
@@ -737,9 +893,32 @@ def _note_matching_keywords(note: models.Note, keywords: List[str], key: bytes)
         lowered = cleaned.lower()
         if lowered in seen:
             continue
-        if _note_matches_query(note, cleaned, key):
-            matches.append(cleaned)
         seen.add(lowered)
+        prepared.append((cleaned, lowered))
+    return prepared
+
+
+def _note_matching_keywords(
+    note: models.Note,
+    keywords: List[Tuple[str, str]],
+    key: bytes,
+    decrypted: Optional[_DecryptCache] = None,
+) -> List[str]:
+    matches: List[str] = []
+    # Built once per note rather than once per keyword; content is decrypted
+    # lazily, only if some keyword misses the plaintext fields.
+    metadata: Optional[str] = None
+    content: Optional[str] = None
+    for cleaned, lowered in keywords:
+        if metadata is None:
+            metadata = _note_metadata_text(note)
+        if lowered in metadata:
+            matches.append(cleaned)
+            continue
+        if content is None:
+            content = (decrypted or _DecryptCache(key)).lower(note)
+        if lowered in content:
+            matches.append(cleaned)
     return matches
 
 
@@ -764,19 +943,22 @@ def _extract_keywords_from_text(text: Optional[str], limit: int = 6) -> List[str
     if not text:
         return []
     raw = str(text)
-    lowered = raw.lower()
-    tokens = WORD_TOKEN_PATTERN.findall(lowered)
-    if len(tokens) < limit:
-        for block in CJK_TOKEN_PATTERN.findall(raw):
-            if len(tokens) >= limit:
-                break
-            if len(block) <= 4:
-                tokens.append(block)
-                continue
-            for i in range(0, len(block) - 1):
-                tokens.append(block[i : i + 2])
-                if len(tokens) >= limit:
-                    break
+    # lower() leaves CJK untouched, so the lowered text serves both token kinds.
+    tokens: List[str] = []
+    blocks: List[str] = []
+    for match in KEYWORD_TOKEN_PATTERN.finditer(raw.lower()):
+        if match.lastgroup == "word":
+            tokens.append(match.group())
+        else:
+            blocks.append(match.group())
+    # Word tokens come first; CJK runs only fill up the remaining slots.
+    for block in blocks:
+        if len(tokens) >= limit:
+            break
+        if len(block) <= 4:
+            tokens.append(block)
+            continue
+        tokens.extend(CJK_BIGRAM_PATTERN.findall(block)[: limit - len(tokens)])
     if not tokens:
         cleaned = " ".join(raw.split()).strip()
         if cleaned:
@@ -784,20 +966,25 @@ def _extract_keywords_from_text(text: Optional[str], limit: int = 6) -> List[str
     return tokens[:limit]
 
 
-def _build_related_keywords(note: models.Note, key: bytes) -> List[str]:
+def _build_related_keywords(
+    note: models.Note, key: bytes, decrypted: Optional[_DecryptCache] = None
+) -> List[str]:
     tokens: List[str] = []
-    tags = _normalize_tags(_safe_json_loads(note.ai_tags, []))
+    tags = _normalize_tags(_note_json(note, "ai_tags", []))
     tokens.extend(tags)
     tokens.extend(_extract_keywords_from_text(note.title, limit=4))
     tokens.extend(_extract_keywords_from_text(note.short_title, limit=4))
     tokens.extend(_extract_keywords_from_text(note.ai_summary, limit=6))
     if len(tokens) < 6:
-        content = crypto.decrypt_content(note.content, key) if note.content_encrypted else note.content
-        first_line = _first_non_empty_line(content or "")
+        content = (decrypted or _DecryptCache(key)).get(note)
+        first_line = _first_non_empty_line(content)
         tokens.extend(_extract_keywords_from_text(first_line, limit=6))
     return _dedupe_keywords(tokens, RELATED_KEYWORD_LIMIT)
 
 
+# strptime is slow and search requests keep resending the same few dates;
+# datetimes are immutable, so the parsed values can be shared.
+@lru_cache(maxsize=1024)
 def _parse_date(value: Optional[str]) -> Optional[datetime]:
     if not value:
         return None
@@ -817,30 +1004,6 @@ def _apply_time_filter(query, time_start: Optional[str], time_end: Optional[str]
     return query
 
 
-def _parse_embedding(raw: Optional[str]) -> Optional[List[float]]:
-    if not raw:
-        return None
-    try:
-        data = json.loads(raw)
-    except (json.JSONDecodeError, TypeError):
-        return None
-    if not isinstance(data, list):
-        return None
-    embedding = [float(value) for value in data if isinstance(value, (int, float))]
-    return embedding or None
-
-
-def _cosine_similarity(vec_a: List[float], vec_b: List[float]) -> float:
-    if not vec_a or not vec_b or len(vec_a) != len(vec_b):
-        return 0.0
-    dot = sum(a * b for a, b in zip(vec_a, vec_b))
-    norm_a = sum(a * a for a in vec_a) ** 0.5
-    norm_b = sum(b * b for b in vec_b) ** 0.5
-    if norm_a == 0 or norm_b == 0:
-        return 0.0
-    return dot / (norm_a * norm_b)
-
-
 def _is_anonymous_tag(value: str) -> bool:
     return bool(ANON_TAG_PATTERN.search(value))
 
@@ -871,6 +1034,27 @@ def _tag_like_pattern(tag: str) -> str:
     return f"%{_escape_like(token)}%"
 
 
+def _tag_filters(tag: str) -> List[Any]:
+    filters = [models.Note.ai_tags.ilike(_tag_like_pattern(tag), escape="\\")]
+    if HAS_NOTES_FTS and TAG_WORD_PATTERN.search(tag):
+        # The FTS probe narrows the scan to notes containing the tag's words; the
+        # LIKE above still decides, so matching is exactly as before.
+        phrase = '"' + tag.replace('"', '""') + '"'
+        filters.append(
+            models.Note.id.in_(
+                text("SELECT rowid FROM notes_fts WHERE notes_fts MATCH :tag_phrase")
+                .bindparams(tag_phrase=phrase)
+                .columns(column("rowid"))
+            )
+        )
+    return filters
+
+
+def _dump_tags(tags: List[str]) -> str:
+    # Stays ASCII-escaped so stored tags match _tag_like_pattern; compact otherwise.
+    return json.dumps(tags, separators=(",", ":"))
+
+
 def _anonymize_text(value: Optional[str]) -> str:
     if value is None:
         return ""
@@ -974,33 +1158,82 @@ def _generate_title(analysis: Dict[str, Any], content: str) -> Optional[str]:
     return candidate
 
 
+# The columns search ranking reads. Candidates are fetched as plain rows of
+# these; full Note objects are only loaded for the page that is returned.
+SEARCH_RANK_COLUMNS = (
+    models.Note.id,
+    models.Note.title,
+    models.Note.short_title,
+    models.Note.ai_summary,
+    models.Note.ai_tags,
+    models.Note.ai_entities,
+    models.Note.search_text,
+    models.Note.content,
+    models.Note.content_encrypted,
+)
+
+
+def _pinned_first_page(
+    query, pinned_filter, pinned_order, offset: int, limit: int
+) -> List[models.Note]:
+    """
+    One page of query with pinned notes first, without sorting every note.
+
+    Only the few pinned notes (and unpinned ones that still carry a pinned_at)
+    are sorted by pinned_order; the rest are read newest first straight off the
+    created_at indexes, which is where the full sort would have placed them.
+    """
+    pinned_total = query.filter(pinned_filter).with_entities(func.count(models.Note.id)).scalar()
+    notes: List[models.Note] = []
+    if offset < pinned_total:
+        notes = (
+            query.filter(pinned_filter).order_by(*pinned_order).offset(offset).limit(limit).all()
+        )
+    remaining = limit - len(notes)
+    if remaining > 0:
+        notes.extend(
+            query.filter(not_(pinned_filter))
+            .order_by(models.Note.created_at.desc())
+            .offset(max(0, offset - pinned_total))
+            .limit(remaining)
+            .all()
+        )
+    return notes
+
+
 def _semantic_search_notes(
-    notes: List[models.Note],
+    db: Session,
+    notes: List[Any],
     semantic_query: str,
     keywords: List[str],
     key: bytes,
     limit: int,
     offset: int,
     use_ai: bool,
+    index: embedding_index.NoteEmbeddingIndex,
     include_content: bool = True,
 ) -> Tuple[List[schemas.NoteOut], int]:
     keyword_list = keywords or [semantic_query]
     direct_query = (keyword_list[0] if keyword_list else semantic_query).strip()
     direct_query_lower = direct_query.lower()
-    query_embedding = ai.get_embedding(semantic_query, use_ai=use_ai)
-    ranked: List[Tuple[Tuple[float, float, float, float, float], float, models.Note, schemas.SearchInfo]] = []
+    query_embedding = ai.get_query_embedding(semantic_query, use_ai=use_ai)
+    # One matrix-vector product scores every note; the loops below only look up.
+    similarities = index.similarities(query_embedding) if query_embedding else {}
+    decrypted = _DecryptCache(key)
+    match_keywords = _prepare_keywords(keyword_list)
+    # (rank key, note, match type, matched keywords, similarity, score); the
+    # SearchInfo models are only built for the page that is returned.
+    ranked: List[
+        Tuple[Tuple[float, float, float, float, float], Any, str, List[str], float, float]
+    ] = []
     for note in notes:
-        matched_keywords = _note_matching_keywords(note, keyword_list, key)
+        matched_keywords = _note_matching_keywords(note, match_keywords, key, decrypted)
         text_match = bool(matched_keywords)
         matched_count = len(matched_keywords)
         direct_match = False
         if direct_query_lower:
             direct_match = any(item.lower() == direct_query_lower for item in matched_keywords)
-        similarity = 0.0
-        if query_embedding:
-            note_embedding = _parse_embedding(note.embedding)
-            if note_embedding:
-                similarity = _cosine_similarity(query_embedding, note_embedding)
+        similarity = similarities.get(note.id, 0.0)
         score = similarity
         if text_match:
             score += 0.25
@@ -1022,79 +1255,94 @@ def _semantic_search_notes(
                 similarity,
                 score,
             )
-            ranked.append(
-                (
-                    rank_key,
-                    score,
-                    note,
-                    schemas.SearchInfo(
-                        match_type=match_type,
-                        matched_keywords=matched_keywords,
-                        similarity=similarity,
-                        score=score,
-                    ),
-                )
-            )
+            ranked.append((rank_key, note, match_type, matched_keywords, similarity, score))
+    page: List[Tuple[Any, str, List[str], float, float]]
     if not ranked and query_embedding:
-        for note in notes:
-            note_embedding = _parse_embedding(note.embedding)
-            if note_embedding:
-                similarity = _cosine_similarity(query_embedding, note_embedding)
-                ranked.append(
-                    (
-                        (0.0, 0.0, 0.0, similarity, similarity),
-                        similarity,
-                        note,
-                        schemas.SearchInfo(
-                            match_type="semantic",
-                            matched_keywords=[],
-                            similarity=similarity,
-                            score=similarity,
-                        ),
-                    )
-                )
-    ranked.sort(key=lambda item: item[0], reverse=True)
-    total = len(ranked)
-    sliced = ranked[offset : offset + limit]
+        # Nothing matched: rank every embedded note by similarity alone. A stable
+        # argsort keeps ties in the incoming (newest first) order.
+        embedded = [note for note in notes if index.has_embedding(note.id)]
+        sims = np.array([similarities.get(note.id, 0.0) for note in embedded], dtype=np.float64)
+        order = np.arange(len(sims))
+        needed = offset + limit
+        if needed < len(sims):
+            # Partition first so only notes that can reach the page get sorted;
+            # everything tied with the cutoff is kept so the stable order holds.
+            cutoff = np.partition(sims, len(sims) - needed)[len(sims) - needed]
+            order = np.flatnonzero(sims >= cutoff)
+        order = order[np.argsort(-sims[order], kind="stable")][offset:needed]
+        page = [
+            (embedded[position], "semantic", [], sims[position].item(), sims[position].item())
+            for position in order.tolist()
+        ]
+        total = len(embedded)
+    else:
+        total = len(ranked)
+        # Only the requested page is ordered; nlargest matches a stable reverse sort.
+        page = [
+            item[1:] for item in heapq.nlargest(offset + limit, ranked, key=lambda item: item[0])
+        ][offset:]
+    loaded: Dict[int, models.Note] = {}
+    if page:
+        page_query = (
+            db.query(models.Note)
+            .filter(models.Note.id.in_([row.id for row, *_ in page]))
+            .options(defer(models.Note.embedding), raiseload("*"))
+        )
+        if not include_content:
+            page_query = page_query.options(defer(models.Note.content))
+        loaded = {note.id: note for note in page_query}
     items = [
-        _note_to_schema(note, key, search_info, include_content=include_content)
-        for _, _, note, search_info in sliced
+        _note_to_schema(
+            loaded[row.id],
+            key,
+            schemas.SearchInfo(
+                match_type=match_type,
+                matched_keywords=matched_keywords,
+                similarity=similarity,
+                score=score,
+            ),
+            include_content=include_content,
+            decrypted=decrypted,
+        )
+        for row, match_type, matched_keywords, similarity, score in page
+        if row.id in loaded
     ]
     return items, total
 
 
 def _related_notes(
+    db: Session,
     note: models.Note,
-    notes: List[models.Note],
+    notes: List[Any],
     key: bytes,
-    query_embedding: Optional[List[float]],
+    similarities: Optional[Dict[int, float]],
     limit: int,
 ) -> Tuple[List[schemas.NoteOut], int, str]:
-    keywords = _build_related_keywords(note, key)
+    decrypted = _DecryptCache(key)
+    keywords = _build_related_keywords(note, key, decrypted)
+    match_keywords = _prepare_keywords(keywords)
     direct_query = (keywords[0] if keywords else "").strip()
     direct_query_lower = direct_query.lower()
     ranked: List[
-        Tuple[Tuple[float, float, float, float, float], float, models.Note, schemas.SearchInfo]
+        Tuple[Tuple[float, float, float, float, float], float, Any, schemas.SearchInfo]
     ] = []
     used_semantic = False
     for candidate in notes:
         if candidate.id == note.id:
             continue
         matched_keywords = (
-            _note_matching_keywords(candidate, keywords, key) if keywords else []
+            _note_matching_keywords(candidate, match_keywords, key, decrypted)
+            if match_keywords
+            else []
         )
         text_match = bool(matched_keywords)
         matched_count = len(matched_keywords)
         direct_match = False
         if direct_query_lower:
             direct_match = any(item.lower() == direct_query_lower for item in matched_keywords)
-        similarity = 0.0
-        if query_embedding:
-            note_embedding = _parse_embedding(candidate.embedding)
-            if note_embedding:
-                similarity = _cosine_similarity(query_embedding, note_embedding)
-        has_semantic_match = bool(
-            query_embedding and similarity >= SEMANTIC_SIMILARITY_THRESHOLD
+        similarity = similarities.get(candidate.id, 0.0) if similarities is not None else 0.0
+        has_semantic_match = (
+            similarities is not None and similarity >= SEMANTIC_SIMILARITY_THRESHOLD
         )
         if has_semantic_match:
             used_semantic = True
@@ -1130,13 +1378,21 @@ def _related_notes(
                 ),
             )
         )
-    ranked.sort(key=lambda item: item[0], reverse=True)
     total = len(ranked)
-    sliced = ranked[:limit]
+    sliced = heapq.nlargest(limit, ranked, key=lambda item: item[0])
     mode = "semantic" if used_semantic else "keyword"
+    loaded: Dict[int, models.Note] = {}
+    if sliced:
+        loaded = {
+            candidate.id: candidate
+            for candidate in db.query(models.Note)
+            .filter(models.Note.id.in_([row.id for _, _, row, _ in sliced]))
+            .options(defer(models.Note.embedding), defer(models.Note.content))
+        }
     items = [
-        _note_to_schema(candidate, key, search_info, include_content=False)
-        for _, _, candidate, search_info in sliced
+        _note_to_schema(loaded[row.id], key, search_info, include_content=False)
+        for _, _, row, search_info in sliced
+        if row.id in loaded
     ]
     return items, total, mode
 
@@ -1209,7 +1465,7 @@ def update_settings(
     settings_payload: Dict[str, Any] = {"ai_enabled": ai_enabled}
     if categories:
         settings_payload["categories"] = categories
-    payload_json = json.dumps(settings_payload)
+    payload_json = json_utils.dumps(settings_payload)
     if current_user.settings:
         current_user.settings.payload = payload_json
     else:
@@ -1257,7 +1513,7 @@ def export_tracker(
     if not payload:
         payload = {"projects": [], "activeProjectId": "", "activeTableId": ""}
     if export_format == "json":
-        content = json.dumps(payload, ensure_ascii=False, indent=2)
+        content = json_utils.dumps(payload, indent=True)
         return Response(
             content=content,
             media_type="application/json",
@@ -1391,9 +1647,52 @@ def import_tracker(
             pass
 
 
+def _store_note_embedding(
+    user_id: int, note_id: int, embedding_token: str, embedding_source: str
+) -> None:
+    """
+    Background task: embed a saved note and store the vector.
+
+    The embedding is only needed for search, so the save response does not wait
+    on the provider round trip. Each save that schedules a task commits a fresh
+    embedding_token on the note; if another save replaced it meanwhile, this
+    older vector is dropped so tasks finishing out of order cannot regress it.
+    """
+    try:
+        embedding = ai.get_embedding(embedding_source, already_anonymized=True, use_ai=True)
+    except Exception:
+        logger.exception("Embedding failed for note_id=%s", note_id)
+        return
+    if not embedding:
+        return
+    db = SessionLocal()
+    try:
+        updated = (
+            db.query(models.Note)
+            .filter(models.Note.id == note_id, models.Note.embedding_token == embedding_token)
+            .update(
+                {
+                    models.Note.embedding: embedding_index.pack_vector(embedding),
+                    models.Note.embedding_source_hash: ai.embedding_source_digest(
+                        embedding_source
+                    ),
+                    # Not an edit; keep the onupdate default from bumping it.
+                    models.Note.updated_at: models.Note.updated_at,
+                },
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+    finally:
+        db.close()
+    if updated:
+        _notes_changed(user_id)
+
+
 @app.post("/api/notes", response_model=schemas.NoteOut)
 def create_note(
     payload: schemas.NoteCreate,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
@@ -1405,7 +1704,7 @@ def create_note(
         categories=allowed_categories,
         use_ai=use_ai,
     )
-    analysis = _restore_mapping_in_obj(analysis_anonymized, mapping)
+    analysis = ai.restore_sensitive_data_in_obj(analysis_anonymized, mapping)
 
     title = _normalize_title(payload.title)
     if not title and isinstance(analysis, dict):
@@ -1443,11 +1742,10 @@ def create_note(
         analysis_anonymized.get("tags") if isinstance(analysis_anonymized, dict) else None,
         title_source,
     )
-    embedding = ai.get_embedding(embedding_source, already_anonymized=True, use_ai=use_ai)
-    embedding_json = json.dumps(embedding) if embedding else None
 
     key = crypto.derive_key(current_user.password_hash, current_user.salt)
     encrypted = crypto.encrypt_content(payload.content, key)
+    embedding_token = secrets.token_hex(8) if use_ai else None
 
     note = models.Note(
         user_id=current_user.id,
@@ -1458,10 +1756,10 @@ def create_note(
         ai_category=category,
         folder=payload.folder,
         ai_summary=summary,
-        ai_tags=json.dumps(tags),
-        ai_entities=json.dumps(entities),
+        ai_tags=_dump_tags(tags),
+        ai_entities=json_utils.dumps(entities),
         ai_sensitivity=sensitivity,
-        embedding=embedding_json,
+        embedding_token=embedding_token,
         created_at=now_beijing(),
         updated_at=now_beijing(),
     )
@@ -1469,6 +1767,11 @@ def create_note(
     db.flush()
     _sync_note_attachments(db, current_user, note, payload.content)
     db.commit()
+    _notes_changed(current_user.id)
+    if embedding_token:
+        background_tasks.add_task(
+            _store_note_embedding, current_user.id, note.id, embedding_token, embedding_source
+        )
     db.refresh(note)
     return _note_to_schema(note, key)
 
@@ -1499,19 +1802,44 @@ def list_notes(
     if tag:
         cleaned_tag = str(tag or "").strip()
         if cleaned_tag:
-            query = query.filter(
-                models.Note.ai_tags.ilike(_tag_like_pattern(cleaned_tag), escape="\\")
-            )
+            query = query.filter(*_tag_filters(cleaned_tag))
     if q:
+        # Read before the notes are queried, so a result computed across a
+        # concurrent write is not cached as current.
+        cache_version = search_cache.version(current_user.id)
+        cache_key = (
+            "list",
+            q.strip(),
+            category,
+            folder,
+            tag,
+            time_start,
+            time_end,
+            include_content,
+            include_completed,
+            use_ai,
+            page,
+            page_size,
+        )
+        cached = search_cache.get(current_user.id, cache_key)
+        if cached is not None:
+            items, total = cached
+            return schemas.NoteListOut(items=items, total=total, page=page, page_size=page_size)
         search_meta = ai.parse_search_query(q, use_ai=use_ai)
         semantic_query = search_meta.get("semantic_query") or q
         keywords = search_meta.get("keywords") or [semantic_query]
         query = _apply_time_filter(query, search_meta.get("time_start"), search_meta.get("time_end"))
         query = _apply_time_filter(query, time_start, time_end)
-        notes = query.order_by(models.Note.created_at.desc()).all()
+        notes = (
+            query.with_entities(*SEARCH_RANK_COLUMNS)
+            .order_by(models.Note.created_at.desc())
+            .all()
+        )
+        index = embedding_index.get_index(db, current_user.id, (note.id for note in notes))
         key = crypto.derive_key(current_user.password_hash, current_user.salt)
         start = (page - 1) * page_size
         items, total = _semantic_search_notes(
+            db,
             notes,
             semantic_query,
             keywords,
@@ -1519,11 +1847,15 @@ def list_notes(
             page_size,
             start,
             use_ai=use_ai,
+            index=index,
             include_content=include_content,
         )
+        search_cache.put(current_user.id, cache_version, cache_key, (items, total))
         return schemas.NoteListOut(items=items, total=total, page=page, page_size=page_size)
     query = _apply_time_filter(query, time_start, time_end)
-    notes_query = query.options(defer(models.Note.embedding))
+    # Listing never touches relationships; raiseload turns an accidental lazy
+    # load (one SELECT per listed note) into an error instead.
+    notes_query = query.options(defer(models.Note.embedding), raiseload("*"))
     if not include_content:
         notes_query = notes_query.options(
             defer(models.Note.content),
@@ -1534,31 +1866,33 @@ def list_notes(
     # For general requests, show globally-pinned notes first
     if category:
         # Category page: category-pinned first, then globally-pinned, then normal notes
-        notes = (
-            notes_query.order_by(
-                models.Note.pinned_category.desc(),
-                models.Note.pinned_global.desc(), 
-                models.Note.pinned_at.desc(),
-                models.Note.created_at.desc()
-            )
-            .offset((page - 1) * page_size)
-            .limit(page_size)
-            .all()
+        pinned_filter = or_(
+            models.Note.pinned_category.is_(True),
+            models.Note.pinned_global.is_(True),
+            models.Note.pinned_at.isnot(None),
+        )
+        pinned_order = (
+            models.Note.pinned_category.desc(),
+            models.Note.pinned_global.desc(),
+            models.Note.pinned_at.desc(),
+            models.Note.created_at.desc(),
         )
     else:
         # Home/general page: globally-pinned first, then normal notes
-        notes = (
-            notes_query.order_by(
-                models.Note.pinned_global.desc(),
-                models.Note.pinned_at.desc(),
-                models.Note.created_at.desc()
-            )
-            .offset((page - 1) * page_size)
-            .limit(page_size)
-            .all()
+        pinned_filter = or_(models.Note.pinned_global.is_(True), models.Note.pinned_at.isnot(None))
+        pinned_order = (
+            models.Note.pinned_global.desc(),
+            models.Note.pinned_at.desc(),
+            models.Note.created_at.desc(),
         )
-    # Use func.count() with specific column for better performance
-    total = query.with_entities(func.count(models.Note.id)).scalar()
+    offset = (page - 1) * page_size
+    notes = _pinned_first_page(notes_query, pinned_filter, pinned_order, offset, page_size)
+    if len(notes) < page_size and (notes or offset == 0):
+        # A short page is the last one, so the total is already known.
+        total = offset + len(notes)
+    else:
+        # Use func.count() with specific column for better performance
+        total = query.with_entities(func.count(models.Note.id)).scalar()
     key = (
         crypto.derive_key(current_user.password_hash, current_user.salt)
         if include_content
@@ -1580,7 +1914,7 @@ def notes_timeline(
     include_completed: bool = Query(default=False),
 ):
     group_clean = str(group or "").strip().lower()
-    if group_clean not in ("month", "day"):
+    if group_clean not in TIMELINE_FORMATS:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid group")
 
     base_filters = [models.Note.user_id == current_user.id]
@@ -1591,17 +1925,16 @@ def notes_timeline(
     if tag:
         cleaned_tag = str(tag or "").strip()
         if cleaned_tag:
-            base_filters.append(
-                models.Note.ai_tags.ilike(_tag_like_pattern(cleaned_tag), escape="\\")
-            )
+            base_filters.extend(_tag_filters(cleaned_tag))
     
     query = db.query(models.Note).filter(*base_filters)
     query = _apply_time_filter(query, time_start, time_end)
 
-    if group_clean == "day":
-        key_expr = func.strftime("%Y-%m-%d", models.Note.created_at)
-    else:
-        key_expr = func.strftime("%Y-%m", models.Note.created_at)
+    # The format is inlined rather than bound so the expression matches the
+    # idx_notes_user_day/month indexes and the GROUP BY can walk them in order.
+    key_expr = func.strftime(
+        literal_column(f"'{TIMELINE_FORMATS[group_clean]}'"), models.Note.created_at
+    )
 
     rows = (
         query.with_entities(key_expr.label("key"), func.count(models.Note.id).label("count"))
@@ -1619,17 +1952,24 @@ def random_note(
     current_user: models.User = Depends(get_current_user),
     include_completed: bool = Query(default=False),
 ):
-    note = (
-        db.query(models.Note)
+    ids_query = (
+        db.query(models.Note.id)
         .filter(models.Note.user_id == current_user.id)
         .filter(
             text("1=1")
             if include_completed
             else or_(models.Note.completed.is_(None), models.Note.completed.is_(False))
         )
-        .order_by(func.random())
-        .first()
     )
+    # Pick by position over the ids instead of ORDER BY random(), which reads
+    # and sorts every matching row; both the count and the offset stay in the index.
+    total = ids_query.count()
+    note = None
+    if total:
+        picked_id = (
+            ids_query.order_by(models.Note.id).offset(secrets.randbelow(total)).limit(1).scalar()
+        )
+        note = db.query(models.Note).filter(models.Note.id == picked_id).first()
     if not note:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No notes available")
     key = crypto.derive_key(current_user.password_hash, current_user.salt)
@@ -1681,14 +2021,25 @@ def upload_attachment(
     user_dir = os.path.join(UPLOAD_DIR, f"user_{current_user.id}")
     os.makedirs(user_dir, exist_ok=True)
     stored_path = os.path.join(user_dir, stored_name)
+    max_size = MAX_UPLOAD_MB * 1024 * 1024
+    size = 0
+    too_large = False
     try:
+        # Copy in 1MB chunks and stop as soon as the limit is passed, rather than
+        # writing an oversized file out in full and checking afterwards.
         with open(stored_path, "wb") as target:
-            shutil.copyfileobj(file.file, target)
+            while True:
+                chunk = file.file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_size > 0 and size > max_size:
+                    too_large = True
+                    break
+                target.write(chunk)
     finally:
         file.file.close()
-    size = os.path.getsize(stored_path) if os.path.exists(stored_path) else 0
-    max_size = MAX_UPLOAD_MB * 1024 * 1024
-    if max_size > 0 and size > max_size:
+    if too_large:
         try:
             os.remove(stored_path)
         except OSError:
@@ -1703,26 +2054,18 @@ def upload_attachment(
         size=size,
     )
     db.add(attachment)
-    db.commit()
-    db.refresh(attachment)
     if note is not None:
+        # Flush for the attachment id so the link goes into the same commit.
+        db.flush()
         db.add(models.NoteAttachment(note_id=note.id, attachment_id=attachment.id))
-        db.commit()
-    note_ids = {
-        row[0]
-        for row in (
-            db.query(models.NoteAttachment.note_id)
-            .filter(models.NoteAttachment.attachment_id == attachment.id)
-            .all()
-        )
-        if row and row[0]
-    }
-    if attachment.note_id:
-        note_ids.add(attachment.note_id)
+    db.commit()
+    db.refresh(attachment)
+    # A new attachment can only be linked to the note it was uploaded with.
+    note_ids = [note.id] if note is not None else []
     return schemas.AttachmentOut(
         id=attachment.id,
         note_id=attachment.note_id,
-        note_ids=sorted(note_ids),
+        note_ids=note_ids,
         filename=attachment.filename,
         mime_type=attachment.mime_type,
         size=attachment.size,
@@ -1763,7 +2106,7 @@ def list_attachments(
     )
 
     attachment_ids = [attachment.id for attachment in attachments]
-    note_ids_map: Dict[int, set] = {}
+    note_ids_map: DefaultDict[int, Set[int]] = defaultdict(set)
     if attachment_ids:
         rows = (
             db.query(models.NoteAttachment.attachment_id, models.NoteAttachment.note_id)
@@ -1773,16 +2116,19 @@ def list_attachments(
         for attachment_id_value, note_id_value in rows:
             if not attachment_id_value or not note_id_value:
                 continue
-            note_ids_map.setdefault(int(attachment_id_value), set()).add(int(note_id_value))
+            note_ids_map[int(attachment_id_value)].add(int(note_id_value))
     for attachment in attachments:
         if attachment.note_id:
-            note_ids_map.setdefault(int(attachment.id), set()).add(int(attachment.note_id))
+            note_ids_map[int(attachment.id)].add(int(attachment.note_id))
+    sorted_note_ids = {
+        attachment_id: sorted(note_ids) for attachment_id, note_ids in note_ids_map.items()
+    }
 
     items = [
         schemas.AttachmentOut(
             id=attachment.id,
             note_id=attachment.note_id,
-            note_ids=sorted(note_ids_map.get(int(attachment.id), set())),
+            note_ids=sorted_note_ids.get(int(attachment.id), []),
             filename=attachment.filename,
             mime_type=attachment.mime_type,
             size=attachment.size,
@@ -1835,7 +2181,7 @@ def get_attachment(
             )
             if not linked:
                 raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
-    file_path = os.path.join(UPLOAD_DIR, f"user_{attachment.user_id}", attachment.stored_name)
+    file_path = _attachment_file_path(attachment)
     if not os.path.exists(file_path):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File missing")
     return FileResponse(
@@ -1845,9 +2191,25 @@ def get_attachment(
     )
 
 
+def _attachment_file_path(attachment: models.Attachment) -> str:
+    return os.path.join(UPLOAD_DIR, f"user_{attachment.user_id}", attachment.stored_name)
+
+
+def _remove_attachment_files(file_paths: List[str]) -> None:
+    # Runs as a background task after the response, once the rows are committed.
+    for file_path in file_paths:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.warning("Failed to remove attachment file: %s", file_path)
+
+
 @app.delete("/api/attachments/{attachment_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_attachment(
     attachment_id: int,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
@@ -1863,14 +2225,10 @@ def delete_attachment(
         .filter(models.NoteAttachment.attachment_id == attachment.id)
         .delete(synchronize_session=False)
     )
-    file_path = os.path.join(UPLOAD_DIR, f"user_{attachment.user_id}", attachment.stored_name)
-    if os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-        except OSError:
-            logger.warning("Failed to remove attachment file: %s", file_path)
+    file_path = _attachment_file_path(attachment)
     db.delete(attachment)
     db.commit()
+    background_tasks.add_task(_remove_attachment_files, [file_path])
     return None
 
 
@@ -1885,12 +2243,12 @@ def related_notes(
     note = (
         db.query(models.Note)
         .filter(models.Note.id == note_id, models.Note.user_id == current_user.id)
+        .options(defer(models.Note.embedding))
         .first()
     )
     if not note:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Note not found")
     use_ai = _is_ai_enabled_for_user(current_user)
-    query_embedding = _parse_embedding(note.embedding) if use_ai else None
     notes_query = (
         db.query(models.Note)
         .filter(models.Note.user_id == current_user.id, models.Note.id != note_id)
@@ -1900,12 +2258,19 @@ def related_notes(
             else or_(models.Note.completed.is_(None), models.Note.completed.is_(False))
         )
         .order_by(models.Note.created_at.desc())
+        .with_entities(*SEARCH_RANK_COLUMNS)
     )
-    if not query_embedding:
-        notes_query = notes_query.options(defer(models.Note.embedding))
     notes = notes_query.all()
+    similarities = None
+    if use_ai:
+        index = embedding_index.get_index(
+            db, current_user.id, [note.id] + [item.id for item in notes]
+        )
+        query_vector = index.vector(note.id)
+        if query_vector is not None:
+            similarities = index.similarities(query_vector)
     key = crypto.derive_key(current_user.password_hash, current_user.salt)
-    items, total, mode = _related_notes(note, notes, key, query_embedding, limit)
+    items, total, mode = _related_notes(db, note, notes, key, similarities, limit)
     return schemas.RelatedNotesOut(items=items, total=total, mode=mode)
 
 
@@ -1913,6 +2278,7 @@ def related_notes(
 def update_note(
     note_id: int,
     payload: schemas.NoteUpdate,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
@@ -1942,19 +2308,32 @@ def update_note(
                 note.pinned_at = now_beijing() if payload.pinned_category else None
         note.updated_at = now_beijing()
         db.commit()
+        _notes_changed(current_user.id)
         db.refresh(note)
         key = crypto.derive_key(current_user.password_hash, current_user.salt)
         return _note_to_schema(note, key)
 
-    anonymized, mapping = ai.anonymize_sensitive_data(payload.content)
+    key = crypto.derive_key(current_user.password_hash, current_user.salt)
+    # Metadata edits (category, pins) resend the unchanged body; that skips
+    # re-encryption and attachment syncing, and anonymizing unless reanalyzing.
+    try:
+        content_changed = (
+            not note.content_encrypted or _DecryptCache(key).get(note) != payload.content
+        )
+    except Exception:
+        # Unreadable ciphertext is simply replaced, as before.
+        content_changed = True
     allowed_categories = _get_allowed_category_keys(current_user)
     use_ai = _is_ai_enabled_for_user(current_user)
-    analysis_anonymized = (
-        ai.analyze_note(anonymized, categories=allowed_categories, use_ai=use_ai)
-        if payload.reanalyze
-        else {}
-    )
-    analysis = _restore_mapping_in_obj(analysis_anonymized, mapping)
+    anonymized = ""
+    analysis_anonymized: Any = {}
+    analysis: Any = {}
+    if payload.reanalyze:
+        anonymized, mapping = ai.anonymize_sensitive_data(payload.content)
+        analysis_anonymized = ai.analyze_note(
+            anonymized, categories=allowed_categories, use_ai=use_ai
+        )
+        analysis = ai.restore_sensitive_data_in_obj(analysis_anonymized, mapping)
 
     if payload.title is not None:
         note.title = _normalize_title(payload.title)
@@ -1970,18 +2349,19 @@ def update_note(
     if short_title:
         note.short_title = short_title
 
+    embedding_source: Optional[str] = None
     if payload.reanalyze:
         analysis_category = str(analysis.get("category") or "").strip().lower()
         if analysis_category in allowed_categories:
             note.ai_category = analysis_category
         tags = _normalize_tags(analysis.get("tags") or _safe_json_loads(note.ai_tags, []))
-        note.ai_tags = json.dumps(tags)
+        note.ai_tags = _dump_tags(tags)
         summary = analysis.get("summary") or note.ai_summary
         note.ai_summary = str(summary) if summary is not None else note.ai_summary
         entities = analysis.get("entities") or _safe_json_loads(note.ai_entities, {})
         if not isinstance(entities, dict):
             entities = {}
-        note.ai_entities = json.dumps(entities)
+        note.ai_entities = json_utils.dumps(entities)
         note.ai_sensitivity = analysis.get("sensitivity") or note.ai_sensitivity
         embedding_source = _build_embedding_source(
             anonymized,
@@ -1989,8 +2369,6 @@ def update_note(
             analysis_anonymized.get("tags") if isinstance(analysis_anonymized, dict) else None,
             analysis_anonymized.get("title") if isinstance(analysis_anonymized, dict) else None,
         )
-        embedding = ai.get_embedding(embedding_source, already_anonymized=True, use_ai=use_ai)
-        note.embedding = json.dumps(embedding) if embedding else note.embedding
 
     if payload.short_title is not None:
         note.short_title = _normalize_short_title(payload.short_title)
@@ -2004,7 +2382,7 @@ def update_note(
         note.folder = str(payload.folder).strip() or None
 
     if payload.tags is not None:
-        note.ai_tags = json.dumps(_normalize_tags(payload.tags))
+        note.ai_tags = _dump_tags(_normalize_tags(payload.tags))
 
     if payload.completed is not None:
         note.completed = bool(payload.completed)
@@ -2018,14 +2396,22 @@ def update_note(
         if payload.pinned_global is None:  # Only update pinned_at if global wasn't also updated
             note.pinned_at = now_beijing() if payload.pinned_category else None
 
-    key = crypto.derive_key(current_user.password_hash, current_user.salt)
-    note.content = crypto.encrypt_content(payload.content, key)
-    note.content_encrypted = True
+    if content_changed:
+        note.content = crypto.encrypt_content(payload.content, key)
+        note.content_encrypted = True
+        _sync_note_attachments(db, current_user, note, payload.content)
     note.updated_at = now_beijing()
-
-    _sync_note_attachments(db, current_user, note, payload.content)
+    embedding_token = None
+    if embedding_source is not None and use_ai:
+        embedding_token = secrets.token_hex(8)
+        note.embedding_token = embedding_token
 
     db.commit()
+    _notes_changed(current_user.id)
+    if embedding_token:
+        background_tasks.add_task(
+            _store_note_embedding, current_user.id, note.id, embedding_token, embedding_source
+        )
     db.refresh(note)
     return _note_to_schema(note, key)
 
@@ -2033,11 +2419,12 @@ def update_note(
 @app.delete("/api/notes/{note_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_note(
     note_id: int,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
     note = (
-        db.query(models.Note)
+        db.query(models.Note.id)
         .filter(models.Note.id == note_id, models.Note.user_id == current_user.id)
         .first()
     )
@@ -2053,62 +2440,66 @@ def delete_note(
         )
     ]
     
-    attachments_to_check = []
-    
-    attachments = db.query(models.Attachment).filter(models.Attachment.note_id == note.id).all()
-    for attachment in attachments:
-        other_links_count = (
-            db.query(models.NoteAttachment)
-            .filter(
-                models.NoteAttachment.attachment_id == attachment.id,
-                models.NoteAttachment.note_id != note.id
-            )
-            .count()
-        )
-        if other_links_count > 0:
-            attachment.note_id = None
-        else:
-            attachments_to_check.append(attachment)
-    
+    # Attachments owned by the note, plus unowned ones it merely links to.
+    attachment_filter = models.Attachment.note_id == note.id
     if linked_attachment_ids:
-        attachments_linked_only = (
-            db.query(models.Attachment)
-            .filter(
+        attachment_filter = or_(
+            attachment_filter,
+            and_(
                 models.Attachment.user_id == current_user.id,
                 models.Attachment.id.in_(linked_attachment_ids),
                 models.Attachment.note_id.is_(None),
+            ),
+        )
+    attachments = db.query(models.Attachment).filter(attachment_filter).all()
+    # Links from other notes, counted for all of them in one grouped query.
+    other_links: Dict[int, int] = {}
+    if attachments:
+        other_links = dict(
+            db.query(models.NoteAttachment.attachment_id, func.count())
+            .filter(
+                models.NoteAttachment.attachment_id.in_([item.id for item in attachments]),
+                models.NoteAttachment.note_id != note.id,
             )
+            .group_by(models.NoteAttachment.attachment_id)
             .all()
         )
-        for attachment in attachments_linked_only:
-            other_links_count = (
-                db.query(models.NoteAttachment)
-                .filter(
-                    models.NoteAttachment.attachment_id == attachment.id,
-                    models.NoteAttachment.note_id != note.id
-                )
-                .count()
-            )
-            if other_links_count == 0:
-                attachments_to_check.append(attachment)
+
+    delete_ids: List[int] = []
+    reparent_ids: List[int] = []
+    file_paths: List[str] = []
+    for attachment in attachments:
+        if not other_links.get(attachment.id):
+            delete_ids.append(attachment.id)
+            file_paths.append(_attachment_file_path(attachment))
+        elif attachment.note_id == note.id:
+            reparent_ids.append(attachment.id)
     
+    # Set-based statements instead of ORM deletes, which would load and
+    # delete every attachment, share and link row one at a time.
     (
         db.query(models.NoteAttachment)
         .filter(models.NoteAttachment.note_id == note.id)
         .delete(synchronize_session=False)
     )
-    
-    for attachment in attachments_to_check:
-        file_path = os.path.join(UPLOAD_DIR, f"user_{attachment.user_id}", attachment.stored_name)
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except OSError:
-                logger.warning("Failed to remove attachment file: %s", file_path)
-        db.delete(attachment)
-    
-    db.delete(note)
+    if reparent_ids:
+        (
+            db.query(models.Attachment)
+            .filter(models.Attachment.id.in_(reparent_ids))
+            .update({models.Attachment.note_id: None}, synchronize_session=False)
+        )
+    if delete_ids:
+        (
+            db.query(models.Attachment)
+            .filter(models.Attachment.id.in_(delete_ids))
+            .delete(synchronize_session=False)
+        )
+    db.query(models.Share).filter(models.Share.note_id == note.id).delete(synchronize_session=False)
+    db.query(models.Note).filter(models.Note.id == note.id).delete(synchronize_session=False)
     db.commit()
+    _notes_changed(current_user.id)
+    if file_paths:
+        background_tasks.add_task(_remove_attachment_files, file_paths)
     return None
 
 
@@ -2122,13 +2513,25 @@ def search_notes(
     if not payload.include_completed:
         query = query.filter(or_(models.Note.completed.is_(None), models.Note.completed.is_(False)))
     use_ai = _is_ai_enabled_for_user(current_user)
+    cache_version = search_cache.version(current_user.id)
+    cache_key = ("search", payload.query.strip(), payload.include_completed, use_ai, payload.limit)
+    cached = search_cache.get(current_user.id, cache_key)
+    if cached is not None:
+        items, total = cached
+        return schemas.NoteListOut(items=items, total=total, page=1, page_size=payload.limit)
     search_meta = ai.parse_search_query(payload.query, use_ai=use_ai)
     semantic_query = search_meta.get("semantic_query") or payload.query
     keywords = search_meta.get("keywords") or [semantic_query]
     query = _apply_time_filter(query, search_meta.get("time_start"), search_meta.get("time_end"))
-    notes = query.order_by(models.Note.created_at.desc()).all()
+    notes = (
+        query.with_entities(*SEARCH_RANK_COLUMNS)
+        .order_by(models.Note.created_at.desc())
+        .all()
+    )
+    index = embedding_index.get_index(db, current_user.id, (note.id for note in notes))
     key = crypto.derive_key(current_user.password_hash, current_user.salt)
     items, total = _semantic_search_notes(
+        db,
         notes,
         semantic_query,
         keywords,
@@ -2136,7 +2539,9 @@ def search_notes(
         payload.limit,
         0,
         use_ai=use_ai,
+        index=index,
     )
+    search_cache.put(current_user.id, cache_version, cache_key, (items, total))
     return schemas.NoteListOut(items=items, total=total, page=1, page_size=payload.limit)
 
 
@@ -2153,45 +2558,78 @@ def rebuild_embeddings(
             detail="AI is disabled; embeddings are unavailable.",
         )
     base_query = db.query(models.Note).filter(models.Note.user_id == current_user.id)
-    total = base_query.count()
-    query = base_query.order_by(models.Note.id.desc())
+    # The total covers every note, not just those past the cursor, so it rides
+    # along as an uncorrelated subquery (evaluated once) rather than a window.
+    total_column = (
+        base_query.with_entities(func.count(models.Note.id)).scalar_subquery().label("total")
+    )
+    query = base_query.add_columns(total_column).order_by(models.Note.id.desc())
     if payload.cursor:
         query = query.filter(models.Note.id < payload.cursor)
     if payload.batch_size:
         query = query.limit(payload.batch_size)
-    notes = query.all()
+    rows = query.all()
+    notes = [note for note, _ in rows]
+    total = rows[0][1] if rows else base_query.with_entities(func.count(models.Note.id)).scalar()
     allowed_categories = _get_allowed_category_keys(current_user)
+    allowed_category_set = frozenset(allowed_categories)
     key = crypto.derive_key(current_user.password_hash, current_user.salt)
+    # Analysis and embedding calls can take minutes; detach the loaded rows and
+    # end the read transaction so the pooled connection is free meanwhile. The
+    # bulk UPDATE below checks a connection out again.
+    db.expunge_all()
+    db.rollback()
     updated = 0
     failed = 0
     failures: List[int] = []
+    # (note, changed columns, embedding source); rows are written in one bulk
+    # UPDATE at the end rather than by dirtying every ORM instance.
+    pending: List[Tuple[models.Note, Dict[str, Any], str]] = []
+    # (note, plaintext, anonymized plaintext, placeholder mapping)
+    prepared: List[Tuple[models.Note, str, str, Dict[str, str]]] = []
     for note in notes:
         try:
             content = crypto.decrypt_content(note.content, key) if note.content_encrypted else note.content
             anonymized_content, mapping = ai.anonymize_sensitive_data(content)
-            analysis_anonymized: Any = {}
+        except Exception:
+            logger.exception("Rebuild embeddings failed for note_id=%s", note.id)
+            failed += 1
+            failures.append(note.id)
+            continue
+        prepared.append((note, content, anonymized_content, mapping))
+    # Each analysis is its own LLM round trip; they run concurrently rather
+    # than back to back.
+    analyses: List[Any] = [{}] * len(prepared)
+    if payload.reanalyze:
+        analyses = ai.analyze_notes(
+            [anonymized_content for _, _, anonymized_content, _ in prepared],
+            categories=allowed_categories,
+            use_ai=use_ai,
+        )
+    for (note, content, anonymized_content, mapping), analysis_anonymized in zip(
+        prepared, analyses
+    ):
+        try:
+            if isinstance(analysis_anonymized, Exception):
+                raise analysis_anonymized
             analysis: Dict[str, Any] = {}
+            changes: Dict[str, Any] = {}
             if payload.reanalyze:
-                analysis_anonymized = ai.analyze_note(
-                    anonymized_content,
-                    categories=allowed_categories,
-                    use_ai=use_ai,
-                )
-                analysis = _restore_mapping_in_obj(analysis_anonymized, mapping)
+                analysis = ai.restore_sensitive_data_in_obj(analysis_anonymized, mapping)
                 if not isinstance(analysis, dict):
                     analysis = {}
                 analysis_category = str(analysis.get("category") or "").strip().lower()
-                if analysis_category in allowed_categories:
-                    note.ai_category = analysis_category
+                if analysis_category in allowed_category_set:
+                    changes["ai_category"] = analysis_category
                 tags = _normalize_tags(analysis.get("tags") or _safe_json_loads(note.ai_tags, []))
-                note.ai_tags = json.dumps(tags)
+                changes["ai_tags"] = _dump_tags(tags)
                 summary = analysis.get("summary") or note.ai_summary
-                note.ai_summary = str(summary) if summary is not None else note.ai_summary
+                changes["ai_summary"] = str(summary) if summary is not None else note.ai_summary
                 entities = analysis.get("entities") or _safe_json_loads(note.ai_entities, {})
                 if not isinstance(entities, dict):
                     entities = {}
-                note.ai_entities = json.dumps(entities)
-                note.ai_sensitivity = analysis.get("sensitivity") or note.ai_sensitivity
+                changes["ai_entities"] = json_utils.dumps(entities)
+                changes["ai_sensitivity"] = analysis.get("sensitivity") or note.ai_sensitivity
             short_title = _build_short_title(
                 analysis if payload.reanalyze else None,
                 content,
@@ -2199,7 +2637,7 @@ def rebuild_embeddings(
                 prefer_title=not payload.reanalyze,
             )
             if short_title and (payload.reanalyze or not note.short_title):
-                note.short_title = short_title
+                changes["short_title"] = short_title
             summary_source = None
             tags_source: Any = None
             title_source: Optional[str] = None
@@ -2208,29 +2646,86 @@ def rebuild_embeddings(
                 tags_source = analysis_anonymized.get("tags")
                 title_source = analysis_anonymized.get("title")
             if summary_source is None:
-                summary_source = _anonymize_text(note.ai_summary)
+                summary_source = _anonymize_text(changes.get("ai_summary", note.ai_summary))
             if tags_source is None:
                 tags_source = [
                     _anonymize_text(tag)
-                    for tag in _normalize_tags(_safe_json_loads(note.ai_tags, []))
+                    for tag in _normalize_tags(
+                        _safe_json_loads(changes.get("ai_tags", note.ai_tags), [])
+                    )
                 ]
             if title_source is None:
                 title_source = _anonymize_text(note.title)
             embedding_source = _build_embedding_source(
                 anonymized_content, summary_source, tags_source, title_source
             )
-            embedding = ai.get_embedding(embedding_source, already_anonymized=True, use_ai=use_ai)
-            if not embedding:
-                failed += 1
-                failures.append(note.id)
-                continue
-            note.embedding = json.dumps(embedding)
-            updated += 1
+            pending.append((note, changes, embedding_source))
         except Exception:
             logger.exception("Rebuild embeddings failed for note_id=%s", note.id)
             failed += 1
             failures.append(note.id)
+    # One batched provider call for the whole page instead of one per note.
+    # Notes whose stored vector was computed from the same source keep it, and
+    # identical sources within the page are embedded once.
+    digests = [ai.embedding_source_digest(source) for _, _, source in pending]
+    current = [
+        bool(note.embedding) and note.embedding_source_hash == digest
+        for (note, _, _), digest in zip(pending, digests)
+    ]
+    sources: Dict[str, str] = {}
+    for (_, _, source), digest, is_current in zip(pending, digests, current):
+        if not is_current:
+            sources.setdefault(digest, source)
+    embeddings: Dict[str, Optional[List[float]]] = {}
+    if sources:
+        try:
+            embeddings = dict(
+                zip(
+                    sources,
+                    ai.get_embeddings(list(sources.values()), already_anonymized=True, use_ai=use_ai),
+                )
+            )
+        except Exception:
+            logger.exception("Rebuild embeddings request failed for %s notes", len(sources))
+    updates: List[Dict[str, Any]] = []
+    search_text_columns = frozenset(models.SEARCH_TEXT_COLUMNS)
+    for (note, changes, _), digest, is_current in zip(pending, digests, current):
+        embedding = embeddings.get(digest)
+        if is_current:
+            updated += 1
+        elif embedding:
+            changes["embedding"] = embedding_index.pack_vector(embedding)
+            changes["embedding_source_hash"] = digest
+            updated += 1
+        else:
+            # Reanalysis results are kept even when the embedding call failed.
+            failed += 1
+            failures.append(note.id)
+        if not changes:
+            continue
+        if not search_text_columns.isdisjoint(changes):
+            # Bulk updates skip ORM events, so the search text is rebuilt here.
+            changes["search_text"] = models.build_search_text(
+                *(
+                    changes.get(column, getattr(note, column))
+                    for column in models.SEARCH_TEXT_COLUMNS
+                )
+            )
+        updates.append({"id": note.id, **changes})
+    if updates:
+        # Notes deleted while the AI calls ran are skipped; the bulk UPDATE
+        # raises if any of its rows is missing.
+        existing = {
+            note_id
+            for (note_id,) in db.query(models.Note.id).filter(
+                models.Note.id.in_([update["id"] for update in updates])
+            )
+        }
+        db.bulk_update_mappings(
+            models.Note, [update for update in updates if update["id"] in existing]
+        )
     db.commit()
+    _notes_changed(current_user.id)
     next_cursor = None
     if payload.batch_size and notes and len(notes) == payload.batch_size:
         next_cursor = notes[-1].id
@@ -2269,17 +2764,35 @@ def create_share(
 
 @app.get("/api/shares/{token}", response_model=schemas.ShareView)
 def get_share(token: str, db: Session = Depends(get_db)):
-    share = db.query(models.Share).filter(models.Share.share_token == token).first()
+    # Share, note and owner in one query instead of a lazy load for each.
+    share = (
+        db.query(models.Share)
+        .filter(models.Share.share_token == token)
+        .options(
+            joinedload(models.Share.note)
+            .defer(models.Note.embedding)
+            .joinedload(models.Note.user)
+        )
+        .first()
+    )
     if not share:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Share not found")
     if share.expires_at and ensure_beijing_tz(share.expires_at) < now_beijing():
         raise HTTPException(status_code=status.HTTP_410_GONE, detail="Share expired")
-    share.view_count += 1
-    db.commit()
     user = share.note.user
     key = crypto.derive_key(user.password_hash, user.salt)
+    # Built before the commit, which would expire the loaded rows.
     note_out = _note_to_schema(share.note, key)
-    return schemas.ShareView(note=note_out, expires_at=share.expires_at, view_count=share.view_count)
+    # Incremented in SQL so concurrent views of one link are all counted.
+    (
+        db.query(models.Share)
+        .filter(models.Share.id == share.id)
+        .update({models.Share.view_count: models.Share.view_count + 1}, synchronize_session=False)
+    )
+    view_count = share.view_count + 1
+    expires_at = share.expires_at
+    db.commit()
+    return schemas.ShareView(note=note_out, expires_at=expires_at, view_count=view_count)
 
 
 @app.delete("/api/shares/{share_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -2288,15 +2801,15 @@ def delete_share(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
-    share = (
+    # One owner-scoped DELETE; the row count tells a missing share apart.
+    owned_note_ids = db.query(models.Note.id).filter(models.Note.user_id == current_user.id)
+    deleted = (
         db.query(models.Share)
-        .join(models.Note)
-        .filter(models.Share.id == share_id, models.Note.user_id == current_user.id)
-        .first()
+        .filter(models.Share.id == share_id, models.Share.note_id.in_(owned_note_ids))
+        .delete(synchronize_session=False)
     )
-    if not share:
+    if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Share not found")
-    db.delete(share)
     db.commit()
     return None
 
@@ -2311,22 +2824,71 @@ def ai_ask(
     # Allow non-AI fallback
     
     query = payload.query.lower()
-    notes = (
-        db.query(models.Note)
-        .filter(models.Note.user_id == current_user.id)
-        .order_by(models.Note.created_at.desc())
-        .limit(50)
-        .all()
-    )
+    # Read before the context notes are selected, so an answer computed across
+    # a concurrent write is not cached as current.
+    cache_version = search_cache.version(current_user.id)
+    # Casing, spacing and punctuation aside, only the same words in the same
+    # order may share an answer: embeddings alone rate "... not ..." or a
+    # changed name or number as the same question.
+    query_terms = tuple(re.findall(r"\w+", query))
+    match_ids: List[int] = []
+    query_embedding = ai.get_query_embedding(payload.query, use_ai=use_ai) if use_ai else None
+    if query_embedding:
+        # A near-identical question asked since the notes last changed gets the
+        # same answer without another LLM call.
+        cached = search_cache.get_similar(current_user.id, query_embedding, query_terms)
+        if cached is not None:
+            return cached
+        # Nearest notes by embedding across all of the user's notes, scored by the
+        # cached index in one matrix-vector product.
+        similarities = embedding_index.get_index(db, current_user.id).similarities(
+            query_embedding
+        )
+        match_ids = [
+            note_id
+            for note_id, similarity in heapq.nlargest(
+                AI_ASK_NOTE_LIMIT, similarities.items(), key=lambda item: item[1]
+            )
+            if similarity >= SEMANTIC_SIMILARITY_THRESHOLD
+        ]
+    if not match_ids:
+        # search_text is already lowercased in Python, so the substring test
+        # runs in SQL and the limit applies to matches rather than candidates.
+        match_ids = [
+            note_id
+            for (note_id,) in db.query(models.Note.id)
+            .filter(
+                models.Note.user_id == current_user.id,
+                models.Note.search_text.contains(query, autoescape=True),
+            )
+            .order_by(models.Note.created_at.desc())
+            .limit(AI_ASK_NOTE_LIMIT)
+        ]
     key = crypto.derive_key(current_user.password_hash, current_user.salt)
-    matching: List[schemas.NoteOut] = []
-    for note in notes:
-        summary = note.ai_summary or ""
-        tags = note.ai_tags or ""
-        if query in summary.lower() or query in tags.lower():
-            matching.append(_note_to_schema(note, key))
-    answer = ai.answer_question(payload.query, [note.content for note in matching], use_ai=use_ai)
-    return schemas.AIAskResponse(answer=answer, matches=matching[:5])
+    matching: List[models.Note] = []
+    if match_ids:
+        loaded = {
+            note.id: note
+            for note in db.query(models.Note)
+            .filter(models.Note.id.in_(match_ids))
+            .options(defer(models.Note.embedding))
+        }
+        matching = [loaded[note_id] for note_id in match_ids if note_id in loaded]
+    # Every match's content goes into the prompt, but only the top few are
+    # returned, so full schemas are built for those alone.
+    decrypted = _DecryptCache(key)
+    answer = ai.answer_question(
+        payload.query, [decrypted.get(note) for note in matching], use_ai=use_ai
+    )
+    response = schemas.AIAskResponse(
+        answer=answer,
+        matches=[_note_to_schema(note, key, decrypted=decrypted) for note in matching[:5]],
+    )
+    if query_embedding:
+        search_cache.put_similar(
+            current_user.id, cache_version, query_embedding, query_terms, response
+        )
+    return response
 
 
 @app.post("/api/ai/summarize", response_model=schemas.AISummaryResponse)
@@ -2339,16 +2901,31 @@ def ai_summarize(
     # Allow non-AI fallback
 
     cutoff = now_beijing() - timedelta(days=payload.days)
+    cache_version = search_cache.version(current_user.id)
+    # Only the ciphertext is needed, so the other columns stay on disk.
     notes = (
-        db.query(models.Note)
+        db.query(models.Note.content)
         .filter(models.Note.user_id == current_user.id, models.Note.created_at >= cutoff)
         .order_by(models.Note.created_at.desc())
         .all()
     )
+    # Keyed on the ciphertexts themselves: as the window slides the note set
+    # can change without any write, and a hit skips decryption as well as the
+    # LLM call.
+    digest = hashlib.blake2b(digest_size=16)
+    for note in notes:
+        digest.update(note.content.encode("utf-8"))
+        digest.update(b"\n")
+    cache_key = ("summarize", payload.days, use_ai, digest.digest())
+    cached = search_cache.get(current_user.id, cache_key)
+    if cached is not None:
+        return cached
     key = crypto.derive_key(current_user.password_hash, current_user.salt)
-    contents = [crypto.decrypt_content(note.content, key) for note in notes]
+    contents = crypto.decrypt_contents((note.content for note in notes), key)
     summary = ai.summarize_notes(contents, payload.days, use_ai=use_ai)
-    return schemas.AISummaryResponse(summary=summary)
+    response = schemas.AISummaryResponse(summary=summary)
+    search_cache.put(current_user.id, cache_version, cache_key, response)
+    return response
 
 
 @app.post("/api/ai/organize", response_model=schemas.AIOrganizeResponse)
@@ -2364,10 +2941,17 @@ def ai_organize(
             detail="AI is disabled.",
         )
 
-    # 1. Fetch all notes
-    notes = db.query(models.Note).filter(models.Note.user_id == current_user.id).all()
+    # 1. Fetch all notes (embeddings come pre-parsed from the embedding index;
+    # clustering only needs ids and titles, so the content blob stays on disk)
+    notes = (
+        db.query(models.Note)
+        .filter(models.Note.user_id == current_user.id)
+        .options(defer(models.Note.embedding), defer(models.Note.content))
+        .all()
+    )
     if not notes:
         return schemas.AIOrganizeResponse(categories=[], uncategorized_note_ids=[])
+    index = embedding_index.get_index(db, current_user.id, (note.id for note in notes))
 
     # 2. Local Micro-Clustering (Leader-Follower)
     clusterer = clustering.LeaderFollowerClusterer(threshold=0.65) # Slightly lower threshold for initial grouping
@@ -2375,8 +2959,8 @@ def ai_organize(
     uncategorized_ids = []
     
     for note in notes:
-        embedding = _parse_embedding(note.embedding)
-        if not embedding:
+        embedding = index.vector(note.id)
+        if embedding is None:
             uncategorized_ids.append(note.id)
             continue
             
@@ -2505,7 +3089,7 @@ def ai_organize_apply(
         # Settings categories list (for dropdowns/tabs)
         new_category_items.append({"key": key, "label": label})
 
-    settings_payload = _load_user_settings_payload(current_user)
+    settings_payload = dict(_load_user_settings_payload(current_user))
     settings_payload["taxonomy"] = taxonomy_state
     settings_payload["categories"] = new_category_items
 
@@ -2531,10 +3115,12 @@ def ai_organize_apply(
     chunk_size = 500
     for i in range(0, len(note_ids), chunk_size):
         chunk_ids = note_ids[i:i + chunk_size]
-        notes = db.query(models.Note).filter(
-            models.Note.id.in_(chunk_ids),
-            models.Note.user_id == current_user.id
-        ).all()
+        notes = (
+            db.query(models.Note)
+            .filter(models.Note.id.in_(chunk_ids), models.Note.user_id == current_user.id)
+            .options(defer(models.Note.embedding), defer(models.Note.content))
+            .all()
+        )
         
         for note in notes:
             if note.id in updates:
@@ -2543,11 +3129,12 @@ def ai_organize_apply(
                 note.folder = data["folder"]
         
     db.commit()
+    _notes_changed(current_user.id)
     return None
 
 
 def _save_user_settings_payload(db: Session, user: models.User, payload: Dict[str, Any]) -> None:
-    payload_json = json.dumps(payload, ensure_ascii=False)
+    payload_json = json_utils.dumps(payload)
     if user.settings:
         user.settings.payload = payload_json
     else:
@@ -2557,6 +3144,19 @@ def _save_user_settings_payload(db: Session, user: models.User, payload: Dict[st
 
 
 # Serve static files (Frontend)
+class _HashedAssets(StaticFiles):
+    """Vite puts a content hash in every asset name, so a URL's bytes never change."""
+
+    def file_response(self, *args: Any, **kwargs: Any) -> Response:
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
+# index.html names the current asset hashes; browsers must revalidate it.
+INDEX_HEADERS = {"Cache-Control": "no-cache"}
+
+
 def _mount_frontend():
     if getattr(sys, "frozen", False):
         # PyInstaller: frontend/dist is bundled in _MEIPASS
@@ -2572,14 +3172,14 @@ def _mount_frontend():
     # Mount /assets specifically for efficiency
     assets_dir = os.path.join(static_dir, "assets")
     if os.path.exists(assets_dir):
-        app.mount("/assets", StaticFiles(directory=assets_dir), name="assets")
+        app.mount("/assets", _HashedAssets(directory=assets_dir), name="assets")
 
     # Root route to serve index.html
     @app.get("/")
     async def serve_root():
         index_path = os.path.join(static_dir, "index.html")
         if os.path.exists(index_path):
-            return FileResponse(index_path)
+            return FileResponse(index_path, headers=INDEX_HEADERS)
         return Response("Frontend not found. Please ensure frontend/dist is built.", status_code=404)
 
     # Catch-all route for SPA
@@ -2597,7 +3197,7 @@ def _mount_frontend():
         # Fallback to index.html
         index_path = os.path.join(static_dir, "index.html")
         if os.path.exists(index_path):
-            return FileResponse(index_path)
+            return FileResponse(index_path, headers=INDEX_HEADERS)
         
         raise HTTPException(status_code=404, detail="Frontend not found")
 
@@ -1,7 +1,21 @@
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, Text, UniqueConstraint
+from typing import Any, Optional
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    UniqueConstraint,
+    event,
+)
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
+from . import json_utils
 from .database import Base
 
 
@@ -62,7 +76,17 @@ class Note(Base):
     ai_entities = Column(Text)
     ai_sensitivity = Column(String)
     folder = Column(String)
-    embedding = Column(Text)
+    # Little-endian float32 vector (see embedding_index.pack_vector)
+    embedding = Column(LargeBinary)
+    # ai.embedding_source_digest of the text the embedding was computed from;
+    # lets a rebuild skip notes whose source has not changed.
+    embedding_source_hash = Column(String)
+    # Random id of the latest scheduled background embedding; an older task
+    # finding a different value drops its result (see _store_note_embedding).
+    embedding_token = Column(String)
+    # Lowercased plaintext fields for keyword search (see build_search_text);
+    # maintained on flush. Content is encrypted and never copied here.
+    search_text = Column(Text)
 
     pinned_global = Column(Boolean, default=False)
     pinned_category = Column(Boolean, default=False)
@@ -79,6 +103,52 @@ class Note(Base):
     )
 
 
+def _load_json(raw: Optional[str], default: Any) -> Any:
+    if not raw:
+        return default
+    try:
+        return json_utils.loads(raw)
+    except json_utils.JSONDecodeError:
+        return default
+
+
+# The columns build_search_text reads, in argument order.
+SEARCH_TEXT_COLUMNS = ("title", "short_title", "ai_summary", "ai_tags", "ai_entities")
+# ASCII unit separator between fields. Not NUL: SQLite's LIKE and length() stop
+# at the first NUL, which would hide every field after the title from SQL.
+SEARCH_TEXT_SEPARATOR = "\x1f"
+
+
+def build_search_text(
+    title: Optional[str],
+    short_title: Optional[str],
+    ai_summary: Optional[str],
+    ai_tags: Optional[str],
+    ai_entities: Optional[str],
+) -> str:
+    """Lowercased plaintext fields of a note, separator-joined so matches cannot span fields."""
+    parts = [title or "", short_title or "", ai_summary or ""]
+    tags = _load_json(ai_tags, [])
+    if isinstance(tags, list):
+        parts.extend(str(tag) for tag in tags)
+    elif isinstance(tags, str):
+        parts.append(tags)
+    entities = _load_json(ai_entities, {})
+    if isinstance(entities, dict):
+        for key_text, value_text in entities.items():
+            parts.append(str(key_text))
+            parts.append(str(value_text))
+    elif isinstance(entities, str):
+        parts.append(entities)
+    return SEARCH_TEXT_SEPARATOR.join(parts).lower()
+
+
+@event.listens_for(Note, "before_insert")
+@event.listens_for(Note, "before_update")
+def _refresh_search_text(_mapper, _connection, note: Note) -> None:
+    note.search_text = build_search_text(*(getattr(note, column) for column in SEARCH_TEXT_COLUMNS))
+
+
 class NoteAttachment(Base):
     __tablename__ = "note_attachments"
 
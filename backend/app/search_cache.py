@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "256"))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "300"))
+# Cosine similarity at which two query embeddings count as the same question.
+SEARCH_CACHE_SIMILARITY = float(os.getenv("SEARCH_CACHE_SIMILARITY", "0.95"))
+# Paraphrase entries kept per user; lookups scan them all.
+SIMILAR_ENTRIES_PER_USER = 32
+
+# (user_id, notes version, request key) -> (stored at, result); most recently used last.
+_results: "OrderedDict[Tuple[int, int, Hashable], Tuple[float, Any]]" = OrderedDict()
+# user_id -> (notes version, [(unit query embedding, terms, stored at, result)]);
+# most recently used users and entries last.
+_similar: "OrderedDict[int, Tuple[int, List[Tuple[np.ndarray, Hashable, float, Any]]]]" = OrderedDict()
+_versions: Dict[int, int] = {}
+_lock = threading.Lock()
+
+
+def version(user_id: int) -> int:
+    """
+    The user's current notes version.
+
+    Read it before querying the notes and hand it to put/put_similar: a result
+    computed while a write landed is then dropped instead of being cached as
+    current.
+    """
+    with _lock:
+        return _versions.get(user_id, 0)
+
+
+def get(user_id: int, request_key: Hashable) -> Optional[Any]:
+    """Return a cached search result, or None if missing, expired or the user's notes changed."""
+    if SEARCH_CACHE_SIZE <= 0:
+        return None
+    with _lock:
+        cache_key = (user_id, _versions.get(user_id, 0), request_key)
+        cached = _results.get(cache_key)
+        if cached is None:
+            return None
+        stored_at, result = cached
+        # The TTL also bounds relative time filters ("today", "last week").
+        if time.monotonic() - stored_at > SEARCH_CACHE_TTL:
+            del _results[cache_key]
+            return None
+        _results.move_to_end(cache_key)
+        return result
+
+
+def put(user_id: int, notes_version: int, request_key: Hashable, result: Any) -> None:
+    if SEARCH_CACHE_SIZE <= 0:
+        return
+    with _lock:
+        if _versions.get(user_id, 0) != notes_version:
+            return
+        cache_key = (user_id, notes_version, request_key)
+        _results[cache_key] = (time.monotonic(), result)
+        _results.move_to_end(cache_key)
+        while len(_results) > SEARCH_CACHE_SIZE:
+            _results.popitem(last=False)
+
+
+def _unit(embedding: Iterable[float]) -> Optional[np.ndarray]:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(vector)) if vector.ndim == 1 else 0.0
+    return vector / norm if norm else None
+
+
+def get_similar(user_id: int, embedding: Iterable[float], terms: Hashable) -> Optional[Any]:
+    """
+    Return the result cached for a query with the same terms whose embedding is
+    within SEARCH_CACHE_SIMILARITY.
+
+    Embeddings alone score negations and changed names or numbers as near
+    duplicates, so the terms (e.g. the query's normalized words) must match
+    exactly; the similarity only absorbs differences the terms leave out.
+    """
+    if SEARCH_CACHE_SIZE <= 0:
+        return None
+    query = _unit(embedding)
+    if query is None:
+        return None
+    with _lock:
+        cached = _similar.get(user_id)
+        if cached is None or cached[0] != _versions.get(user_id, 0):
+            return None
+        now = time.monotonic()
+        entries = [
+            entry
+            for entry in cached[1]
+            if entry[1] == terms
+            and now - entry[2] <= SEARCH_CACHE_TTL
+            and entry[0].shape == query.shape
+        ]
+        if not entries:
+            return None
+        sims = np.stack([entry[0] for entry in entries]) @ query
+        best = int(sims.argmax())
+        if sims[best] < SEARCH_CACHE_SIMILARITY:
+            return None
+        _similar.move_to_end(user_id)
+        return entries[best][3]
+
+
+def put_similar(
+    user_id: int, notes_version: int, embedding: Iterable[float], terms: Hashable, result: Any
+) -> None:
+    if SEARCH_CACHE_SIZE <= 0:
+        return
+    query = _unit(embedding)
+    if query is None:
+        return
+    with _lock:
+        if _versions.get(user_id, 0) != notes_version:
+            return
+        cached = _similar.get(user_id)
+        entries = cached[1] if cached is not None and cached[0] == notes_version else []
+        now = time.monotonic()
+        entries = [entry for entry in entries if now - entry[2] <= SEARCH_CACHE_TTL]
+        entries.append((query, terms, now, result))
+        _similar[user_id] = (notes_version, entries[-SIMILAR_ENTRIES_PER_USER:])
+        _similar.move_to_end(user_id)
+        while len(_similar) > SEARCH_CACHE_SIZE:
+            _similar.popitem(last=False)
+
+
+def invalidate(user_id: int) -> None:
+    """Forget the user's cached results; call after committing any change to their notes."""
+    with _lock:
+        _versions[user_id] = _versions.get(user_id, 0) + 1
+        for cache_key in [cache_key for cache_key in _results if cache_key[0] == user_id]:
+            del _results[cache_key]
+        _similar.pop(user_id, None)
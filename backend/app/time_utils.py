@@ -1,8 +1,9 @@
-from datetime import datetime
-import pytz
+from datetime import datetime, timedelta, timezone
 
-# Beijing timezone
-BEIJING_TZ = pytz.timezone("Asia/Shanghai")
+# Beijing timezone. China has kept UTC+8 without DST since 1991, so a fixed
+# offset matches the tz database for every date the app stores and needs no
+# per-call zone lookup.
+BEIJING_TZ = timezone(timedelta(hours=8), "CST")
 
 
 def now_beijing() -> datetime:
@@ -13,5 +14,5 @@ def now_beijing() -> datetime:
 def ensure_beijing_tz(value: datetime) -> datetime:
     """Ensure a datetime is timezone-aware in Beijing time."""
     if value.tzinfo is None or value.tzinfo.utcoffset(value) is None:
-        return BEIJING_TZ.localize(value)
+        return value.replace(tzinfo=BEIJING_TZ)
     return value.astimezone(BEIJING_TZ)
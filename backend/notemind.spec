@@ -30,7 +30,6 @@ hidden_imports += [
     'email.message',
     'email.mime',
     'bcrypt',
-    'pytz',
     'aiofiles',
     'dashscope',
     'requests',